@@ -0,0 +1,40 @@
+"""
+Зависимости FastAPI: сервисы, создаваемые при первом обращении
+"""
+
+from functools import lru_cache
+
+from app.config import settings
+from app.services.chatgpt import BatchingChatGPTService
+from app.services.deploy import DeployService
+from app.services.generation import GenerationService
+
+
+# Сервисы без тяжелой инициализации создаются при первом обращении
+# и затем переиспользуются (используются как зависимости FastAPI)
+
+@lru_cache(maxsize=None)
+def get_chatgpt_service() -> BatchingChatGPTService:
+    """Возвращает сервис коррекции кода через OpenRouter"""
+    return BatchingChatGPTService(
+        api_key=settings.openrouter_api_key,
+        model=settings.openrouter_model,
+        base_url=settings.openrouter_base_url,
+        max_batch=settings.llm_batch_max_size
+    )
+
+
+@lru_cache(maxsize=None)
+def get_generation_service() -> GenerationService:
+    """Возвращает сервис генерации сайтов"""
+    return GenerationService(
+        api_key=settings.openrouter_api_key,
+        model=settings.openrouter_model,
+        base_url=settings.openrouter_base_url
+    )
+
+
+@lru_cache(maxsize=None)
+def get_deploy_service() -> DeployService:
+    """Возвращает сервис деплоя сайтов"""
+    return DeployService(sites_dir=settings.sites_dir)
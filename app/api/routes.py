@@ -2,15 +2,18 @@
 API маршруты для коррекции Astro кода
 """
 
-import os
-import tempfile
+import asyncio
+import hashlib
+import io
+import logging
 from pathlib import Path
-from typing import Optional
-from fastapi import APIRouter, HTTPException, UploadFile, File
-from fastapi.responses import JSONResponse, HTMLResponse, FileResponse
+from typing import Dict, List, Optional, Tuple
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi.responses import ORJSONResponse, FileResponse
 from fastapi import Request
 
 from app.models.schemas import (
+    CorrectionOptions,
     CorrectionRequest,
     CorrectionResponse,
     HealthResponse,
@@ -19,6 +22,8 @@ from app.models.schemas import (
     GenerateResponse,
     PageInfo
 )
+from app.config import settings
+from app.api.deps import get_chatgpt_service, get_deploy_service, get_generation_service
 from app.services.inference import InferenceService
 from app.services.chatgpt import ChatGPTService
 from app.services.generation import GenerationService
@@ -28,36 +33,36 @@ from app import __version__
 
 
 router = APIRouter()
+logger = logging.getLogger("astro.api")
 
-# Глобальные сервисы (инициализируются в main.py)
+# Размер блока при чтении загружаемых файлов
+UPLOAD_CHUNK_SIZE = 1 << 20
+# Максимальный размер загружаемого изображения по умолчанию (20 МБ)
+DEFAULT_MAX_UPLOAD_SIZE = 20 * 1024 * 1024
+
+# Глобальные сервисы с тяжелой инициализацией (инициализируются в main.py)
 inference_service: Optional[InferenceService] = None
-chatgpt_service: Optional[ChatGPTService] = None
-generation_service: Optional[GenerationService] = None
 screenshot_service: Optional[ScreenshotService] = None
-deploy_service: Optional[DeployService] = None
+max_upload_size: int = DEFAULT_MAX_UPLOAD_SIZE
 
 
 def set_services(
     inference: InferenceService,
-    chatgpt: ChatGPTService,
-    generation: GenerationService,
     screenshot: ScreenshotService,
-    deploy: DeployService
+    upload_limit: int = DEFAULT_MAX_UPLOAD_SIZE
 ):
     """Устанавливает сервисы для использования в роутерах"""
-    global inference_service, chatgpt_service, generation_service, screenshot_service, deploy_service
+    global inference_service, screenshot_service, max_upload_size
     inference_service = inference
-    chatgpt_service = chatgpt
-    generation_service = generation
     screenshot_service = screenshot
-    deploy_service = deploy
+    max_upload_size = upload_limit
 
 
 @router.get("/health", response_model=HealthResponse)
 async def health_check():
     """Проверка работоспособности API"""
     model_loaded = inference_service is not None
-    openrouter_configured = chatgpt_service is not None
+    openrouter_configured = bool(settings.openrouter_api_key)
     
     return HealthResponse(
         status="healthy" if (model_loaded and openrouter_configured) else "degraded",
@@ -68,24 +73,22 @@ async def health_check():
 
 
 @router.post("/correct", response_model=CorrectionResponse)
-async def correct_code(request: CorrectionRequest):
+async def correct_code(
+    request: CorrectionRequest,
+    chatgpt_service: ChatGPTService = Depends(get_chatgpt_service)
+):
     """
     Исправляет Astro код на основе детекции объектов
     
     Принимает код страницы, выполняет детекцию и возвращает исправленный код
     """
-    if not inference_service or not chatgpt_service:
+    if not inference_service:
         raise HTTPException(
             status_code=503,
             detail="Services not initialized"
         )
     
     try:
-        # Создаем временный файл для HTML
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False) as html_file:
-            html_file.write(request.astro_code)
-            html_path = html_file.name
-        
         # Для детекции нужен скриншот страницы
         # В реальной системе здесь бы использовался headless браузер (Playwright/Selenium)
         # Для демонстрации используем существующее изображение если есть
@@ -106,17 +109,16 @@ async def correct_code(request: CorrectionRequest):
             )
         
         # Выполняем детекцию
-        detections = inference_service.detect_objects(image_path)
+        detections = await inference_service.detect_objects_async(image_path)
         
         # Исправляем код с помощью ChatGPT
-        options = request.options or {}
-        preserve_blocks = options.preserve_blocks if options.preserve_blocks is not None else True
+        options = request.options or CorrectionOptions()
         
-        correction_result = chatgpt_service.correct_code(
+        correction_result = await chatgpt_service.correct_code(
             astro_code=request.astro_code,
             detections=detections,
             page_id=request.page_id,
-            preserve_blocks=preserve_blocks
+            preserve_blocks=options.preserve_blocks
         )
         
         # Формируем ответ
@@ -126,12 +128,6 @@ async def correct_code(request: CorrectionRequest):
             objects=detections.get("objects", [])
         )
         
-        # Удаляем временный файл
-        try:
-            os.unlink(html_path)
-        except:
-            pass
-        
         return CorrectionResponse(
             status=correction_result.get("status", "success"),
             corrected_code=correction_result.get("corrected_code", request.astro_code),
@@ -143,12 +139,44 @@ async def correct_code(request: CorrectionRequest):
     except HTTPException:
         raise
     except Exception as e:
+        logger.exception("Correction failed for page %s", request.page_id)
         raise HTTPException(
             status_code=500,
             detail=f"Internal server error: {str(e)}"
         )
 
 
+async def _read_upload(upload: UploadFile) -> memoryview:
+    """
+    Читает загруженный файл блоками с ограничением размера
+    
+    Args:
+        upload: Загруженный файл
+        
+    Returns:
+        Содержимое файла
+    """
+    if upload.size is not None and upload.size > max_upload_size:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File too large (max {max_upload_size} bytes)"
+        )
+    
+    buffer = io.BytesIO()
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        if buffer.tell() + len(chunk) > max_upload_size:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File too large (max {max_upload_size} bytes)"
+            )
+        buffer.write(chunk)
+    
+    return buffer.getbuffer()
+
+
 @router.post("/detect")
 async def detect_objects_only(image: UploadFile = File(...)):
     """
@@ -162,32 +190,156 @@ async def detect_objects_only(image: UploadFile = File(...)):
         )
     
     try:
-        # Сохраняем загруженное изображение во временный файл
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp_file:
-            content = await image.read()
-            tmp_file.write(content)
-            tmp_path = tmp_file.name
+        # Изображение декодируется в памяти, без временного файла
+        content = await _read_upload(image)
         
         # Выполняем детекцию
-        detections = inference_service.detect_objects(tmp_path)
-        
-        # Удаляем временный файл
         try:
-            os.unlink(tmp_path)
-        except:
-            pass
+            detections = await inference_service.detect_objects_async(content)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid image: {str(e)}"
+            )
         
-        return JSONResponse(content=detections)
+        return ORJSONResponse(content=detections)
         
+    except HTTPException:
+        raise
     except Exception as e:
+        logger.exception("Detection failed")
         raise HTTPException(
             status_code=500,
             detail=f"Detection error: {str(e)}"
         )
 
 
+def _content_hash(data: bytes) -> bytes:
+    """Вычисляет хеш содержимого для проверки сходимости итераций"""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+async def _correct_pages(
+    pages: List[Dict[str, str]],
+    request: GenerateRequest,
+    chatgpt_service: ChatGPTService
+) -> Tuple[List[Dict[str, str]], List[PageInfo]]:
+    """
+    Итеративно исправляет наложения на страницах сайта
+    
+    На каждой итерации скриншоты всех еще не исправленных страниц
+    создаются параллельно (на страницах из пула ScreenshotService), детекция выполняется одним батчем,
+    а коррекция страниц с наложениями - параллельными запросами к LLM
+    
+    Args:
+        pages: Список словарей с ключами page_id и html
+        request: Параметры запроса генерации
+        chatgpt_service: Сервис коррекции кода
+        
+    Returns:
+        Tuple (исправленные страницы, информация о страницах)
+    """
+    states = [
+        {
+            "page_id": page.get("page_id", "page_1"),
+            "html": page.get("html", ""),
+            "corrections": 0,
+            "overlaps": 0,
+            "code_hash": _content_hash(page.get("html", "").encode('utf-8')),
+            "screenshot_hash": None,
+            "detections": None
+        }
+        for page in pages
+    ]
+    active = list(states)
+    
+    # Итеративная коррекция
+    for iteration in range(request.max_correction_iterations):
+        if not active:
+            break
+        
+        # Создание скриншотов (PNG байты в памяти, без временных файлов)
+        screenshots = await screenshot_service.create_screenshots_batch(
+            [state["html"] for state in active],
+            width=request.viewport_width,
+            height=request.viewport_height
+        )
+        
+        # Если отрисовка страницы не изменилась, детекция даст тот же результат
+        to_detect = []
+        for state, (screenshot_bytes, _) in zip(active, screenshots):
+            screenshot_hash = _content_hash(screenshot_bytes)
+            if screenshot_hash != state["screenshot_hash"]:
+                state["screenshot_hash"] = screenshot_hash
+                to_detect.append((state, screenshot_bytes))
+        
+        # Декодирование и детекция объектов одним батчем
+        # (вне event loop - в пуле инференса или отдельном потоке)
+        if to_detect:
+            detections_list = await inference_service.detect_objects_batch_async(
+                [screenshot_bytes for _, screenshot_bytes in to_detect]
+            )
+            for (state, _), detections in zip(to_detect, detections_list):
+                state["detections"] = detections
+        
+        # Страницы без наложений исправлять не нужно
+        to_correct = []
+        for state in active:
+            state["overlaps"] = state["detections"].get("overlaps", 0)
+            if state["overlaps"] > 0:
+                to_correct.append((state, state["detections"]))
+        
+        # Коррекция кода
+        correction_results = await asyncio.gather(*[
+            chatgpt_service.correct_code(
+                astro_code=state["html"],
+                detections=detections,
+                page_id=state["page_id"],
+                preserve_blocks=True
+            )
+            for state, detections in to_correct
+        ])
+        
+        active = []
+        for (state, _), correction_result in zip(to_correct, correction_results):
+            # Если коррекция не удалась, прекращаем итерации для страницы
+            if correction_result.get("status") != "success":
+                continue
+            
+            corrected_code = correction_result.get("corrected_code", state["html"])
+            code_hash = _content_hash(corrected_code.encode('utf-8'))
+            # LLM вернул тот же код - дальнейшие итерации ничего не изменят
+            if code_hash == state["code_hash"]:
+                continue
+            
+            state["html"] = corrected_code
+            state["code_hash"] = code_hash
+            state["corrections"] += 1
+            active.append(state)
+    
+    corrected_pages = [
+        {"page_id": state["page_id"], "html": state["html"]}
+        for state in states
+    ]
+    pages_info = [
+        PageInfo(
+            page_id=state["page_id"],
+            corrections_applied=state["corrections"],
+            final_overlaps=state["overlaps"]
+        )
+        for state in states
+    ]
+    return corrected_pages, pages_info
+
+
 @router.post("/generate", response_model=GenerateResponse)
-async def generate_site(request: GenerateRequest, http_request: Request):
+async def generate_site(
+    request: GenerateRequest,
+    http_request: Request,
+    generation_service: GenerationService = Depends(get_generation_service),
+    chatgpt_service: ChatGPTService = Depends(get_chatgpt_service),
+    deploy_service: DeployService = Depends(get_deploy_service)
+):
     """
     Генерирует сайт по описанию с итеративной коррекцией наложений
     
@@ -198,7 +350,7 @@ async def generate_site(request: GenerateRequest, http_request: Request):
     4. Деплоит готовый сайт
     5. Возвращает ссылку на сайт
     """
-    if not all([generation_service, screenshot_service, inference_service, chatgpt_service, deploy_service]):
+    if not all([screenshot_service, inference_service]):
         raise HTTPException(
             status_code=503,
             detail="Services not initialized"
@@ -231,78 +383,9 @@ async def generate_site(request: GenerateRequest, http_request: Request):
                 error="No pages generated"
             )
         
-        # Инициализация браузера для скриншотов
-        await screenshot_service.initialize()
-        
-        corrected_pages = []
-        pages_info = []
-        
-        # 2. Обработка каждой страницы
-        for page in pages:
-            page_id = page.get("page_id", "page_1")
-            html_content = page.get("html", "")
-            corrections_count = 0
-            
-            # Итеративная коррекция
-            final_overlaps = 0
-            for iteration in range(request.max_correction_iterations):
-                # Создание скриншота
-                screenshot_path = None
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp_file:
-                    screenshot_path = tmp_file.name
-                
-                try:
-                    screenshot_result, (img_width, img_height) = await screenshot_service.create_screenshot_from_html(
-                        html_content=html_content,
-                        width=request.viewport_width,
-                        height=request.viewport_height,
-                        output_path=screenshot_path
-                    )
-                    
-                    # Детекция объектов
-                    detections = inference_service.detect_objects(screenshot_path)
-                    final_overlaps = detections.get("overlaps", 0)
-                    
-                    # Если нет наложений, можно выходить
-                    if final_overlaps == 0:
-                        break
-                    
-                    # Коррекция кода
-                    correction_result = chatgpt_service.correct_code(
-                        astro_code=html_content,
-                        detections=detections,
-                        page_id=page_id,
-                        preserve_blocks=True
-                    )
-                    
-                    if correction_result.get("status") == "success":
-                        html_content = correction_result.get("corrected_code", html_content)
-                        corrections_count += 1
-                    else:
-                        # Если коррекция не удалась, прекращаем итерации
-                        break
-                    
-                finally:
-                    # Удаляем временный скриншот
-                    if screenshot_path and os.path.exists(screenshot_path):
-                        try:
-                            os.unlink(screenshot_path)
-                        except:
-                            pass
-            
-            corrected_pages.append({
-                "page_id": page_id,
-                "html": html_content
-            })
-            
-            pages_info.append(PageInfo(
-                page_id=page_id,
-                corrections_applied=corrections_count,
-                final_overlaps=final_overlaps
-            ))
-        
-        # Закрываем браузер
-        await screenshot_service.close()
+        # 2. Итеративная коррекция всех страниц
+        # (браузер уже запущен, скриншоты делаются на страницах из общего пула)
+        corrected_pages, pages_info = await _correct_pages(pages, request, chatgpt_service)
         
         # 3. Деплой сайта
         base_url = str(http_request.base_url).rstrip('/')
@@ -328,12 +411,7 @@ async def generate_site(request: GenerateRequest, http_request: Request):
     except HTTPException:
         raise
     except Exception as e:
-        # Убеждаемся, что браузер закрыт при ошибке
-        try:
-            await screenshot_service.close()
-        except:
-            pass
-        
+        logger.exception("Site generation failed")
         return GenerateResponse(
             status="error",
             site_hash="",
@@ -344,44 +422,41 @@ async def generate_site(request: GenerateRequest, http_request: Request):
 
 
 @router.get("/site/{site_hash}")
-async def get_site(site_hash: str):
+async def get_site(
+    site_hash: str,
+    deploy_service: DeployService = Depends(get_deploy_service)
+):
     """
     Возвращает главную страницу деплоенного сайта
     """
-    if not deploy_service:
-        raise HTTPException(
-            status_code=503,
-            detail="Deploy service not initialized"
-        )
+    page_path = deploy_service.get_site_page_path(site_hash, "index")
     
-    html_content = deploy_service.get_site_page(site_hash, "index")
-    
-    if html_content is None:
+    if page_path is None:
         raise HTTPException(
             status_code=404,
             detail=f"Site {site_hash} not found"
         )
     
-    return HTMLResponse(content=html_content)
+    # Файл отдается напрямую с диска (sendfile), без чтения в память
+    return FileResponse(page_path, media_type="text/html")
 
 
 @router.get("/site/{site_hash}/{page_id}")
-async def get_site_page(site_hash: str, page_id: str):
+async def get_site_page(
+    site_hash: str,
+    page_id: str,
+    deploy_service: DeployService = Depends(get_deploy_service)
+):
     """
     Возвращает конкретную страницу деплоенного сайта
     """
-    if not deploy_service:
-        raise HTTPException(
-            status_code=503,
-            detail="Deploy service not initialized"
-        )
-    
-    html_content = deploy_service.get_site_page(site_hash, page_id)
+    page_path = deploy_service.get_site_page_path(site_hash, page_id)
     
-    if html_content is None:
+    if page_path is None:
         raise HTTPException(
             status_code=404,
             detail=f"Page {page_id} not found in site {site_hash}"
         )
     
-    return HTMLResponse(content=html_content)
+    # Файл отдается напрямую с диска (sendfile), без чтения в память
+    return FileResponse(page_path, media_type="text/html")
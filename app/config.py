@@ -0,0 +1,45 @@
+"""
+Настройки приложения
+"""
+
+from pydantic_settings import BaseSettings
+
+
+class Settings(BaseSettings):
+    """Настройки приложения"""
+    # OpenRouter
+    openrouter_api_key: str
+    openrouter_model: str = "openai/gpt-4-turbo-preview"
+    openrouter_base_url: str = "https://openrouter.ai/api/v1"
+    llm_batch_max_size: int = 8
+    
+    # Model
+    model_path: str = "/app/models/model_final.pth"
+    config_path: str = "/app/config/config.yaml"
+    num_classes: int = 1
+    thing_classes: str = "frame"
+    confidence_threshold: float = 0.5
+    inference_workers: int = 0
+    inference_fp16: bool = True
+    inference_compile: bool = False
+    
+    # Screenshots
+    screenshot_max_pages: int = 4
+    
+    # Deploy
+    sites_dir: str = "/app/data/sites"
+    
+    # API
+    api_host: str = "0.0.0.0"
+    api_port: int = 8000
+    log_level: str = "INFO"
+    allowed_origins: str = "*"
+    max_upload_size_mb: int = 20
+    
+    class Config:
+        env_file = ".env"
+        case_sensitive = False
+
+
+# Загрузка настроек
+settings = Settings()
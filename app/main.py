@@ -2,57 +2,64 @@
 Главный файл FastAPI приложения
 """
 
+import asyncio
+import logging
 import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic_settings import BaseSettings
+from fastapi.responses import ORJSONResponse
 
+from app.api.deps import get_chatgpt_service
 from app.api.routes import router, set_services
+from app.config import settings
 from app.services.inference import InferenceService
-from app.services.chatgpt import ChatGPTService
-from app.services.generation import GenerationService
 from app.services.screenshot import ScreenshotService
-from app.services.deploy import DeployService
 from app import __version__
 
 
-class Settings(BaseSettings):
-    """Настройки приложения"""
-    # OpenRouter
-    openrouter_api_key: str
-    openrouter_model: str = "openai/gpt-4-turbo-preview"
-    openrouter_base_url: str = "https://openrouter.ai/api/v1"
+def setup_logging(level: str) -> QueueListener:
+    """
+    Настраивает логгер приложения
     
-    # Model
-    model_path: str = "/app/models/model_final.pth"
-    config_path: str = "/app/config/config.yaml"
-    num_classes: int = 1
-    thing_classes: str = "frame"
-    confidence_threshold: float = 0.5
+    Записи попадают в очередь, а в stdout их пишет отдельный поток
+    QueueListener, поэтому логирование не блокирует event loop
     
-    # Deploy
-    sites_dir: str = "/app/data/sites"
+    Args:
+        level: Уровень логирования
+        
+    Returns:
+        Запущенный QueueListener (останавливается при завершении)
+    """
+    log_queue = queue.SimpleQueue()
+    
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s")
+    )
     
-    # API
-    api_host: str = "0.0.0.0"
-    api_port: int = 8000
-    log_level: str = "INFO"
-    allowed_origins: str = "*"
+    app_logger = logging.getLogger("astro")
+    app_logger.setLevel(level.upper())
+    app_logger.addHandler(QueueHandler(log_queue))
+    app_logger.propagate = False
     
-    class Config:
-        env_file = ".env"
-        case_sensitive = False
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
 
 
-# Загрузка настроек
-settings = Settings()
+# Настройка логирования
+log_listener = setup_logging(settings.log_level)
+logger = logging.getLogger("astro")
 
 # Создание FastAPI приложения
 app = FastAPI(
     title="Astro Correction API",
     description="Система автоматической коррекции сайтов на основе Astro",
-    version=__version__
+    version=__version__,
+    default_response_class=ORJSONResponse
 )
 
 # Настройка CORS
@@ -66,16 +73,13 @@ app.add_middleware(
 
 # Инициализация сервисов
 inference_service = None
-chatgpt_service = None
-generation_service = None
 screenshot_service = None
-deploy_service = None
 
 
 @app.on_event("startup")
 async def startup_event():
     """Инициализация сервисов при запуске"""
-    global inference_service, chatgpt_service, generation_service, screenshot_service, deploy_service
+    global inference_service, screenshot_service
     
     try:
         # Проверка существования файлов модели и конфигурации
@@ -94,56 +98,53 @@ async def startup_event():
             config_path=str(config_path),
             num_classes=settings.num_classes,
             thing_classes=thing_classes_list,
-            confidence_threshold=settings.confidence_threshold
+            confidence_threshold=settings.confidence_threshold,
+            workers=settings.inference_workers,
+            fp16=settings.inference_fp16,
+            compile_model=settings.inference_compile
         )
         
-        # Инициализация ChatGPT Service через OpenRouter
-        chatgpt_service = ChatGPTService(
-            api_key=settings.openrouter_api_key,
-            model=settings.openrouter_model,
-            base_url=settings.openrouter_base_url
-        )
-        
-        # Инициализация Generation Service
-        generation_service = GenerationService(
-            api_key=settings.openrouter_api_key,
-            model=settings.openrouter_model,
-            base_url=settings.openrouter_base_url
-        )
+        # Прогрев модели в отдельном потоке, чтобы первый запрос не ждал инициализацию
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, inference_service.warmup)
         
         # Инициализация Screenshot Service
-        screenshot_service = ScreenshotService(headless=True)
-        
-        # Инициализация Deploy Service
-        deploy_service = DeployService(sites_dir=settings.sites_dir)
+        screenshot_service = ScreenshotService(headless=True, max_pages=settings.screenshot_max_pages)
+        # Браузер запускается один раз на весь жизненный цикл процесса
+        await screenshot_service.initialize()
         
         # Установка сервисов в роутер
+        # (ChatGPT, Generation и Deploy сервисы создаются лениво, см. app.api.deps)
         set_services(
             inference_service,
-            chatgpt_service,
-            generation_service,
             screenshot_service,
-            deploy_service
+            upload_limit=settings.max_upload_size_mb * 1024 * 1024
         )
         
-        print(f"✅ Services initialized successfully")
-        print(f"   Model: {model_path}")
-        print(f"   Config: {config_path}")
-        print(f"   OpenRouter Model: {settings.openrouter_model}")
-        print(f"   Sites directory: {settings.sites_dir}")
+        logger.info("Services initialized successfully")
+        logger.info("Model: %s", model_path)
+        logger.info("Config: %s", config_path)
+        logger.info("OpenRouter Model: %s", settings.openrouter_model)
+        logger.info("Sites directory: %s", settings.sites_dir)
         
-    except Exception as e:
-        print(f"❌ Error initializing services: {e}")
+    except Exception:
+        logger.exception("Error initializing services")
         raise
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Очистка при остановке"""
-    global screenshot_service
+    global inference_service, screenshot_service
+    # Закрываем ChatGPT сервис, только если он успел создаться
+    if get_chatgpt_service.cache_info().currsize:
+        await get_chatgpt_service().aclose()
+    if inference_service:
+        inference_service.close()
     if screenshot_service:
         await screenshot_service.close()
-    print("Shutting down...")
+    logger.info("Shutting down...")
+    log_listener.stop()
 
 
 # Подключение роутеров
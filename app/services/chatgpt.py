@@ -2,15 +2,69 @@
 Сервис для коррекции кода с помощью OpenRouter API
 """
 
-import json
-from typing import Dict, List, Optional
-from openai import OpenAI
+import asyncio
+import hashlib
+import re
+from typing import Dict, List, Optional, Set, Tuple
+import httpx
+import orjson
+from cachetools import LRUCache
+from openai import AsyncOpenAI
+
+
+# Шаблон промпта коррекции (собирается один раз при импорте модуля)
+_PROMPT_TMPL = """Исправь HTML код страницы на основе данных детекции объектов.
+
+Исходный код:
+```html
+{astro_code}
+```
+
+Данные детекции:
+- Всего объектов: {total_objects}
+- Перекрытий: {overlaps}
+- Размер изображения: {img_width}x{img_height} пикселей
+
+Объекты:
+{objects}
+
+Инструкции:
+1. Обнови координаты всех блоков с классом 'block' на основе данных детекции
+2. Конвертируй координаты из пикселей в vw/vh единицы:
+   - left = (x1 / {img_width}) * 100 vw
+   - top = (y1 / {img_height}) * 100 vh
+   - width = ((x2 - x1) / {img_width}) * 100 vw
+   - height = ((y2 - y1) / {img_height}) * 100 vh
+3. {blocks_instruction}
+4. Если обнаружено больше объектов, чем блоков в HTML, добавь новые блоки
+5. Сохрани все остальные атрибуты блоков (z-index, border-radius, background, box-shadow и т.д.)
+6. Верни только исправленный HTML код без дополнительных объяснений
+
+Верни исправленный HTML код:"""
+
+# Маркеры в исправленном коде, по которым определяются примененные исправления
+_MARKERS_RE = re.compile(r"position:absolute|vw|vh")
+
+# Строка описания одного обнаруженного объекта
+_OBJECT_TMPL = "Объект %d: BBox=[%.1f, %.1f, %.1f, %.1f], Размер=%.1fx%.1fpx, Score=%.3f"
 
 
 class ChatGPTService:
     """Сервис для работы с OpenRouter API (поддерживает различные LLM модели)"""
     
-    def __init__(self, api_key: str, model: str = "openai/gpt-4-turbo-preview", base_url: str = "https://openrouter.ai/api/v1"):
+    # Вариант инструкции 3 промпта, индексируется значением preserve_blocks
+    BLOCKS_INSTRUCTIONS = (
+        "Добавь новые блоки для всех обнаруженных объектов",
+        "Сохрани все существующие блоки, только обнови их координаты",
+    )
+    
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "openai/gpt-4-turbo-preview",
+        base_url: str = "https://openrouter.ai/api/v1",
+        cache_size: int = 512
+    ):
         """
         Инициализация сервиса через OpenRouter
         
@@ -18,15 +72,27 @@ class ChatGPTService:
             api_key: API ключ OpenRouter
             model: Модель для использования (формат: provider/model-name)
             base_url: Базовый URL OpenRouter API
+            cache_size: Количество исправлений, хранимых в LRU кэше
         """
-        self.client = OpenAI(
+        # Постоянный HTTP/2 клиент: параллельные запросы мультиплексируются
+        # в одном TCP+TLS соединении вместо отдельного рукопожатия на запрос
+        self._http = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(60.0, connect=5.0),
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+        )
+        self.client = AsyncOpenAI(
             api_key=api_key,
-            base_url=base_url
+            base_url=base_url,
+            http_client=self._http
         )
         self.model = model
         self.api_key = api_key
+        
+        # Кэш исправленного кода: одинаковый код и детекции дают одинаковый промпт
+        self._cache: LRUCache = LRUCache(maxsize=cache_size)
     
-    def correct_code(
+    async def correct_code(
         self,
         astro_code: str,
         detections: Dict,
@@ -45,13 +111,18 @@ class ChatGPTService:
         Returns:
             Словарь с исправленным кодом и информацией об исправлениях
         """
+        cache_key = self._cache_key(astro_code, detections, preserve_blocks)
+        cached = self._cached_result(cache_key)
+        if cached is not None:
+            return cached
+        
         # Формируем промпт для ChatGPT
         prompt = self._build_prompt(astro_code, detections, page_id, preserve_blocks)
         
         try:
             # OpenRouter поддерживает стандартный OpenAI API формат
             # Дополнительные заголовки можно добавить через default_headers при инициализации клиента
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.model,
                 messages=[
                     {
@@ -69,6 +140,8 @@ class ChatGPTService:
             
             corrected_code = response.choices[0].message.content
             
+            self._cache[cache_key] = corrected_code
+            
             # Извлекаем исправления из ответа
             corrections_applied = self._extract_corrections(corrected_code)
             
@@ -86,6 +159,30 @@ class ChatGPTService:
                 "error": str(e)
             }
     
+    async def aclose(self):
+        """Закрывает HTTP соединения с OpenRouter"""
+        await self._http.aclose()
+    
+    def _cache_key(self, astro_code: str, detections: Dict, preserve_blocks: bool) -> bytes:
+        """Формирует ключ кэша из всех данных, влияющих на промпт"""
+        key = hashlib.blake2b(digest_size=16)
+        key.update(astro_code.encode('utf-8'))
+        key.update(b"\0")
+        key.update(orjson.dumps(detections, option=orjson.OPT_SORT_KEYS))
+        key.update(b"\1" if preserve_blocks else b"\0")
+        return key.digest()
+    
+    def _cached_result(self, cache_key: bytes) -> Optional[Dict[str, any]]:
+        """Возвращает результат коррекции из кэша, если он есть"""
+        corrected_code = self._cache.get(cache_key)
+        if corrected_code is None:
+            return None
+        return {
+            "corrected_code": corrected_code,
+            "corrections_applied": self._extract_corrections(corrected_code),
+            "status": "success"
+        }
+    
     def _build_prompt(
         self,
         astro_code: str,
@@ -95,46 +192,27 @@ class ChatGPTService:
     ) -> str:
         """Формирует промпт для LLM через OpenRouter"""
         
-        objects_info = []
-        for obj in detections.get("objects", []):
-            objects_info.append(
-                f"Объект {obj['id']}: "
-                f"BBox=[{obj['bbox'][0]:.1f}, {obj['bbox'][1]:.1f}, {obj['bbox'][2]:.1f}, {obj['bbox'][3]:.1f}], "
-                f"Размер={obj['bbox_size'][0]:.1f}x{obj['bbox_size'][1]:.1f}px, "
-                f"Score={obj['score']:.3f}"
+        objects_info = "\n".join(
+            _OBJECT_TMPL % (
+                obj['id'],
+                obj['bbox'][0], obj['bbox'][1], obj['bbox'][2], obj['bbox'][3],
+                obj['bbox_size'][0], obj['bbox_size'][1],
+                obj['score']
             )
+            for obj in detections.get("objects", [])
+        )
         
         image_size = detections.get("image_size", [390, 2532])
-        img_width, img_height = image_size[0], image_size[1]
         
-        prompt = f"""Исправь HTML код страницы на основе данных детекции объектов.
-
-Исходный код:
-```html
-{astro_code}
-```
-
-Данные детекции:
-- Всего объектов: {detections.get('total_objects', 0)}
-- Перекрытий: {detections.get('overlaps', 0)}
-- Размер изображения: {img_width}x{img_height} пикселей
-
-Объекты:
-{chr(10).join(objects_info)}
-
-Инструкции:
-1. Обнови координаты всех блоков с классом 'block' на основе данных детекции
-2. Конвертируй координаты из пикселей в vw/vh единицы:
-   - left = (x1 / {img_width}) * 100 vw
-   - top = (y1 / {img_height}) * 100 vh
-   - width = ((x2 - x1) / {img_width}) * 100 vw
-   - height = ((y2 - y1) / {img_height}) * 100 vh
-3. {"Сохрани все существующие блоки, только обнови их координаты" if preserve_blocks else "Добавь новые блоки для всех обнаруженных объектов"}
-4. Если обнаружено больше объектов, чем блоков в HTML, добавь новые блоки
-5. Сохрани все остальные атрибуты блоков (z-index, border-radius, background, box-shadow и т.д.)
-6. Верни только исправленный HTML код без дополнительных объяснений
-
-Верни исправленный HTML код:"""
+        prompt = _PROMPT_TMPL.format(
+            astro_code=astro_code,
+            total_objects=detections.get('total_objects', 0),
+            overlaps=detections.get('overlaps', 0),
+            img_width=image_size[0],
+            img_height=image_size[1],
+            objects=objects_info,
+            blocks_instruction=self.BLOCKS_INSTRUCTIONS[bool(preserve_blocks)]
+        )
         
         return prompt
     
@@ -142,10 +220,138 @@ class ChatGPTService:
         """Извлекает список примененных исправлений"""
         corrections = []
         
-        # Простая эвристика для определения исправлений
-        if "position:absolute" in corrected_code:
+        # Простая эвристика для определения исправлений:
+        # все маркеры ищутся за один проход по коду
+        seen = set()
+        for match in _MARKERS_RE.finditer(corrected_code):
+            seen.add(match.group())
+            if len(seen) == 3:
+                break
+        
+        if "position:absolute" in seen:
             corrections.append("Updated block coordinates")
-        if "vw" in corrected_code and "vh" in corrected_code:
+        if "vw" in seen and "vh" in seen:
             corrections.append("Converted pixels to viewport units")
         
         return corrections
+
+
+class BatchingChatGPTService(ChatGPTService):
+    """
+    Сервис коррекции, пропускающий запросы через общую очередь
+    
+    Фоновая задача забирает из очереди все уже ожидающие запросы (не больше
+    max_batch) и сразу отправляет их через общий клиент, не дожидаясь новых,
+    поэтому одиночный запрос не получает дополнительной задержки
+    """
+    
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "openai/gpt-4-turbo-preview",
+        base_url: str = "https://openrouter.ai/api/v1",
+        cache_size: int = 512,
+        max_batch: int = 8
+    ):
+        """
+        Инициализация сервиса с очередью запросов
+        
+        Args:
+            api_key: API ключ OpenRouter
+            model: Модель для использования (формат: provider/model-name)
+            base_url: Базовый URL OpenRouter API
+            cache_size: Количество исправлений, хранимых в LRU кэше
+            max_batch: Максимальное количество запросов в батче
+        """
+        super().__init__(api_key=api_key, model=model, base_url=base_url, cache_size=cache_size)
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()
+    
+    async def correct_code(
+        self,
+        astro_code: str,
+        detections: Dict,
+        page_id: str,
+        preserve_blocks: bool = True
+    ) -> Dict[str, any]:
+        """
+        Ставит запрос на коррекцию в очередь и ожидает результат батча
+        
+        Args:
+            astro_code: Исходный код страницы на Astro
+            detections: Результаты детекции объектов
+            page_id: Идентификатор страницы
+            preserve_blocks: Сохранять существующие блоки
+            
+        Returns:
+            Словарь с исправленным кодом и информацией об исправлениях
+        """
+        # Результат из кэша не нужно ждать в очереди
+        cached = self._cached_result(self._cache_key(astro_code, detections, preserve_blocks))
+        if cached is not None:
+            return cached
+        
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(((astro_code, detections, page_id, preserve_blocks), future))
+        return await future
+    
+    async def aclose(self):
+        """Останавливает обработку очереди, отменяет ожидающие запросы и закрывает соединения"""
+        tasks = list(self._inflight)
+        if self._worker is not None:
+            tasks.append(self._worker)
+            self._worker = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        
+        # Запросы, которые еще не попали в батч, тоже не должны ждать вечно
+        if self._queue is not None:
+            while not self._queue.empty():
+                _, future = self._queue.get_nowait()
+                future.cancel()
+        await super().aclose()
+    
+    def _ensure_worker(self):
+        """Запускает фоновую задачу обработки очереди при первом запросе"""
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+    
+    async def _run(self):
+        """Забирает запросы из очереди батчами и отправляет их"""
+        while True:
+            batch = [await self._queue.get()]
+            # Берем только уже ожидающие запросы, новые не ждем
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            
+            # Батч отправляется отдельной задачей, чтобы не задерживать сбор следующего
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+    
+    async def _dispatch(self, batch: List[Tuple[tuple, asyncio.Future]]):
+        """Выполняет запросы батча параллельно и возвращает результаты ожидающим"""
+        try:
+            results = await asyncio.gather(
+                *[ChatGPTService.correct_code(self, *args) for args, _ in batch],
+                return_exceptions=True
+            )
+        except BaseException:
+            # Батч отменен (aclose) - ожидающие получают отмену вместо зависания
+            for _, future in batch:
+                future.cancel()
+            raise
+        
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
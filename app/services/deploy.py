@@ -3,10 +3,24 @@
 """
 
 import hashlib
-import shutil
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Optional
-import json
+from typing import List, Dict, Optional, Tuple
+import orjson
+
+from app.utils.batch_io import remove_dir, write_files
+
+
+# Количество потоков для параллельного чтения метаданных сайтов
+METADATA_READ_WORKERS = 16
+
+# Параметры сериализации metadata.json
+METADATA_JSON_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+
+# Префикс временных директорий, в которых собираются сайты до публикации
+STAGING_PREFIX = ".staging-"
 
 
 class DeployService:
@@ -30,6 +44,8 @@ class DeployService:
         """
         Деплоит сайт из списка страниц
         
+        Повторный деплой того же содержимого ничего не записывает
+        
         Args:
             pages: Список словарей с ключами page_id и html
             site_metadata: Метаданные сайта (опционально)
@@ -41,40 +57,211 @@ class DeployService:
         content_hash = self._generate_site_hash(pages)
         site_path = self.sites_dir / content_hash
         
-        # Создаем директорию для сайта
-        site_path.mkdir(parents=True, exist_ok=True)
+        # Сайт с таким содержимым уже задеплоен - файлы не перезаписываем
+        if site_path.exists():
+            return content_hash
+        
+        # Файлы пишутся во временную директорию, которая переименовывается в
+        # директорию сайта только целиком: недописанный сайт не виден снаружи
+        # и не мешает повторному деплою
+        staging_path = self._new_staging_dir(content_hash)
+        try:
+            write_files(self._site_files(staging_path, pages, site_metadata))
+            self._link_index(staging_path, pages)
+            self._publish(staging_path, site_path)
+        except BaseException:
+            self._discard_staging(staging_path)
+            raise
+        
+        return content_hash
+    
+    def deploy_site_batch(self, sites: List[Dict]) -> List[str]:
+        """
+        Деплоит несколько сайтов за один вызов
+        
+        Файлы всех сайтов записываются одной пачкой; сайты, которые уже
+        задеплоены (или повторяются в батче), не перезаписываются
+        
+        Args:
+            sites: Список словарей с ключами pages и site_metadata (опционально)
+            
+        Returns:
+            Список хешей сайтов (в порядке sites)
+        """
+        existing = set(os.listdir(self.sites_dir))
+        hashes = []
+        files = []
+        new_sites = []
+        
+        try:
+            for site in sites:
+                pages = site.get("pages", [])
+                content_hash = self._generate_site_hash(pages)
+                hashes.append(content_hash)
+                
+                if content_hash in existing:
+                    continue
+                existing.add(content_hash)
+                
+                # Как и в deploy_site, сайт собирается во временной директории
+                staging_path = self._new_staging_dir(content_hash)
+                new_sites.append((staging_path, self.sites_dir / content_hash, pages))
+                files.extend(self._site_files(staging_path, pages, site.get("site_metadata")))
+            
+            write_files(files)
+            for staging_path, _, pages in new_sites:
+                self._link_index(staging_path, pages)
+            for staging_path, site_path, _ in new_sites:
+                self._publish(staging_path, site_path)
+        except BaseException:
+            # Уже опубликованные сайты остаются, недописанные удаляются
+            for staging_path, _, _ in new_sites:
+                self._discard_staging(staging_path)
+            raise
+        
+        return hashes
+    
+    def _new_staging_dir(self, content_hash: str) -> Path:
+        """
+        Создает временную директорию для сборки сайта
+        
+        Args:
+            content_hash: Хеш сайта
+            
+        Returns:
+            Путь к новой директории внутри sites_dir (та же файловая система,
+            поэтому публикация - атомарное переименование)
+        """
+        staging_path = self.sites_dir / f"{STAGING_PREFIX}{content_hash}-{uuid.uuid4().hex}"
+        staging_path.mkdir()
+        return staging_path
+    
+    def _publish(self, staging_path: Path, site_path: Path):
+        """
+        Переносит собранный сайт на место одним переименованием
+        
+        Args:
+            staging_path: Временная директория с файлами сайта
+            site_path: Директория сайта
+        """
+        try:
+            os.rename(staging_path, site_path)
+        except OSError:
+            if not site_path.is_dir():
+                raise
+            # Тот же сайт успели опубликовать параллельно - оставляем готовую копию
+            self._discard_staging(staging_path)
+    
+    @staticmethod
+    def _discard_staging(staging_path: Path):
+        """Удаляет временную директорию сайта (если она еще существует)"""
+        try:
+            remove_dir(staging_path)
+        except OSError:
+            pass
+    
+    def _site_files(
+        self,
+        site_path: Path,
+        pages: List[Dict[str, str]],
+        site_metadata: Optional[Dict]
+    ) -> List[Tuple[Path, bytes]]:
+        """
+        Формирует список файлов сайта для записи
+        
+        Args:
+            site_path: Директория сайта
+            pages: Список словарей с ключами page_id и html
+            site_metadata: Метаданные сайта (опционально)
+            
+        Returns:
+            Список пар (путь к файлу, содержимое)
+        """
+        files = []
         
         # Сохраняем каждую страницу
         for page in pages:
             page_id = page.get("page_id", "page_1")
             html_content = page.get("html", "")
-            
-            # Сохраняем HTML файл
-            page_file = site_path / f"{page_id}.html"
-            page_file.write_text(html_content, encoding='utf-8')
-        
-        # Создаем index.html (первая страница или главная)
-        index_html = pages[0].get("html", "") if pages else ""
-        index_file = site_path / "index.html"
-        index_file.write_text(index_html, encoding='utf-8')
+            files.append((site_path / f"{page_id}.html", html_content.encode('utf-8')))
         
         # Сохраняем метаданные
         if site_metadata:
-            metadata_file = site_path / "metadata.json"
-            metadata_file.write_text(
-                json.dumps(site_metadata, ensure_ascii=False, indent=2),
-                encoding='utf-8'
-            )
+            files.append((
+                site_path / "metadata.json",
+                orjson.dumps(site_metadata, option=METADATA_JSON_OPTIONS)
+            ))
         
         # Сохраняем список страниц
-        pages_info = [{"page_id": p.get("page_id"), "file": f"{p.get('page_id')}.html"} for p in pages]
-        pages_file = site_path / "pages.json"
-        pages_file.write_text(
-            json.dumps(pages_info, ensure_ascii=False, indent=2),
-            encoding='utf-8'
-        )
+        files.append((site_path / "pages.json", self._pages_json(pages)))
         
-        return content_hash
+        return files
+    
+    @staticmethod
+    def _pages_json(pages: List[Dict[str, str]]) -> bytes:
+        """
+        Сериализует список страниц для pages.json
+        
+        JSON собирается прямо в буфер, без промежуточного словаря на каждую
+        страницу; результат совпадает с orjson.dumps(..., option=OPT_INDENT_2)
+        
+        Args:
+            pages: Список словарей с ключами page_id и html
+            
+        Returns:
+            JSON в байтах
+        """
+        if not pages:
+            return b"[]"
+        
+        buf = bytearray(b"[")
+        for page in pages:
+            page_id = page.get("page_id")
+            buf += b'\n  {\n    "page_id": '
+            buf += orjson.dumps(page_id)
+            buf += b',\n    "file": '
+            buf += orjson.dumps(f"{page_id}.html")
+            buf += b"\n  },"
+        buf[-1:] = b"\n]"
+        return bytes(buf)
+    
+    def _link_index(self, site_path: Path, pages: List[Dict[str, str]]):
+        """
+        Создает index.html (первая страница или главная) как ссылку на файл первой страницы
+        
+        Жесткая ссылка не копирует данные; если файловая система ее не
+        поддерживает, создается символическая ссылка, а в крайнем случае
+        HTML записывается еще раз
+        
+        Args:
+            site_path: Директория сайта (файлы страниц уже записаны)
+            pages: Список словарей с ключами page_id и html
+        """
+        index_path = site_path / "index.html"
+        if not pages:
+            write_files([(index_path, b"")])
+            return
+        
+        page_name = f"{pages[0].get('page_id', 'page_1')}.html"
+        if page_name == index_path.name:
+            # Первая страница сама называется index
+            return
+        
+        try:
+            os.link(site_path / page_name, index_path)
+            return
+        except FileExistsError:
+            return
+        except OSError:
+            pass
+        
+        try:
+            # Относительная ссылка остается верной при переносе директории сайтов
+            os.symlink(page_name, index_path)
+        except FileExistsError:
+            pass
+        except OSError:
+            write_files([(index_path, pages[0].get("html", "").encode('utf-8'))])
     
     def get_site_path(self, site_hash: str) -> Optional[Path]:
         """
@@ -86,62 +273,104 @@ class DeployService:
         Returns:
             Path к директории сайта или None если не найден
         """
+        if site_hash.startswith(STAGING_PREFIX):
+            # Сайт еще собирается
+            return None
+        
         site_path = self.sites_dir / site_hash
         if site_path.exists() and site_path.is_dir():
             return site_path
         return None
     
-    def get_site_page(self, site_hash: str, page_id: str = "index") -> Optional[str]:
+    def get_site_page_path(self, site_hash: str, page_id: str = "index") -> Optional[Path]:
         """
-        Получает HTML код страницы сайта
+        Получает путь к HTML файлу страницы сайта
         
         Args:
             site_hash: Хеш сайта
             page_id: ID страницы или "index" для главной
             
         Returns:
-            HTML код страницы или None если не найдена
+            Path к файлу страницы или None если не найдена
         """
         site_path = self.get_site_path(site_hash)
         if not site_path:
             return None
         
-        if page_id == "index":
-            page_file = site_path / "index.html"
-        else:
-            page_file = site_path / f"{page_id}.html"
+        # "index" тоже хранится как index.html
+        page_file = site_path / f"{page_id}.html"
         
-        if page_file.exists():
-            return page_file.read_text(encoding='utf-8')
+        if page_file.is_file():
+            return page_file
         
         return None
     
-    def list_sites(self) -> List[Dict]:
+    def get_site_page(self, site_hash: str, page_id: str = "index") -> Optional[str]:
+        """
+        Получает HTML код страницы сайта
+        
+        Args:
+            site_hash: Хеш сайта
+            page_id: ID страницы или "index" для главной
+            
+        Returns:
+            HTML код страницы или None если не найдена
+        """
+        page_file = self.get_site_page_path(site_hash, page_id)
+        if page_file is None:
+            return None
+        return page_file.read_text(encoding='utf-8')
+    
+    def list_sites(self, with_metadata: bool = False) -> List[Dict]:
         """
         Возвращает список всех деплоенных сайтов
         
+        Args:
+            with_metadata: Прочитать metadata.json каждого сайта
+                (файлы читаются параллельно в пуле потоков)
+        
         Returns:
             Список словарей с информацией о сайтах
         """
-        sites = []
-        for site_dir in self.sites_dir.iterdir():
-            if site_dir.is_dir():
-                metadata_file = site_dir / "metadata.json"
-                metadata = {}
-                if metadata_file.exists():
-                    try:
-                        metadata = json.loads(metadata_file.read_text(encoding='utf-8'))
-                    except:
-                        pass
-                
-                sites.append({
-                    "site_hash": site_dir.name,
-                    "metadata": metadata,
-                    "path": str(site_dir)
-                })
+        # DirEntry уже знает тип файла, отдельный stat на каждый сайт не нужен
+        with os.scandir(self.sites_dir) as entries:
+            site_dirs = [
+                entry.path for entry in entries
+                if entry.is_dir(follow_symlinks=False) and not entry.name.startswith(STAGING_PREFIX)
+            ]
+        
+        sites = [
+            {
+                "site_hash": os.path.basename(site_dir),
+                "path": site_dir
+            }
+            for site_dir in site_dirs
+        ]
+        
+        if with_metadata and site_dirs:
+            with ThreadPoolExecutor(max_workers=min(METADATA_READ_WORKERS, len(site_dirs))) as executor:
+                for site, metadata in zip(sites, executor.map(self._read_metadata, site_dirs)):
+                    site["metadata"] = metadata
         
         return sites
     
+    @staticmethod
+    def _read_metadata(site_dir: str) -> Dict:
+        """
+        Читает метаданные сайта
+        
+        Args:
+            site_dir: Путь к директории сайта
+            
+        Returns:
+            Метаданные или пустой словарь, если файла нет или он поврежден
+        """
+        try:
+            with open(os.path.join(site_dir, "metadata.json"), 'rb') as f:
+                return orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError):
+            return {}
+    
     def delete_site(self, site_hash: str) -> bool:
         """
         Удаляет деплоенный сайт
@@ -154,7 +383,7 @@ class DeployService:
         """
         site_path = self.get_site_path(site_hash)
         if site_path:
-            shutil.rmtree(site_path)
+            remove_dir(site_path)
             return True
         return False
     
@@ -168,12 +397,16 @@ class DeployService:
         Returns:
             SHA256 хеш (первые 16 символов)
         """
-        # Создаем строку из содержимого всех страниц
-        content = ""
-        for page in sorted(pages, key=lambda x: x.get("page_id", "")):
-            content += page.get("html", "")
+        # Содержимое страниц подается в хеш по очереди, без склейки в одну строку
+        # (результат совпадает с хешем конкатенации)
+        # Обычно страницы уже идут по порядку page_id - тогда сортировка не нужна
+        page_ids = [page.get("page_id", "") for page in pages]
+        if any(page_ids[i] > page_ids[i + 1] for i in range(len(page_ids) - 1)):
+            pages = [pages[i] for i in sorted(range(len(pages)), key=page_ids.__getitem__)]
+        
+        hash_obj = hashlib.sha256()
+        for page in pages:
+            hash_obj.update(page.get("html", "").encode('utf-8'))
         
-        # Генерируем хеш
-        hash_obj = hashlib.sha256(content.encode('utf-8'))
         return hash_obj.hexdigest()[:16]
 
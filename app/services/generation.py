@@ -2,11 +2,57 @@
 Сервис для генерации сайтов по описанию с использованием LLM
 """
 
+import logging
 import re
 from typing import Dict, List, Optional
+import orjson
 from openai import OpenAI
 
 
+logger = logging.getLogger("astro.generation")
+
+# Шаблоны для разбора ответа модели (компилируются один раз)
+_HTML_RE = re.compile(r'<html[^>]*>.*?</html>', re.DOTALL | re.IGNORECASE)
+_BODY_RE = re.compile(r'<body[^>]*>.*?</body>', re.DOTALL | re.IGNORECASE)
+_JSON_PAGES_RE = re.compile(r'\{[^{}]*"page_\d+"[^{}]*\}', re.DOTALL)
+
+# Базовая страница на случай неудачной генерации (%s - описание сайта)
+_DEFAULT_HTML_TMPL = """<!DOCTYPE html>
+<html lang="ru">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Generated Site</title>
+    <style>
+        * {
+            margin: 0;
+            padding: 0;
+            box-sizing: border-box;
+        }
+        body {
+            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, Cantarell, sans-serif;
+            background: linear-gradient(135deg, #667eea 0%%, #764ba2 100%%);
+            min-height: 100vh;
+            position: relative;
+        }
+        .block {
+            position: absolute;
+            background: rgba(255, 255, 255, 0.95);
+            border-radius: 12px;
+            padding: 2vw;
+            box-shadow: 0 8px 32px rgba(0, 0, 0, 0.1);
+        }
+    </style>
+</head>
+<body>
+    <div class="block" style="left: 10vw; top: 10vh; width: 80vw; height: auto; padding: 3vw;">
+        <h1 style="font-size: 4vw; margin-bottom: 2vh; color: #333;">Сгенерированный сайт</h1>
+        <p style="font-size: 2vw; line-height: 1.6; color: #666;">%s</p>
+    </div>
+</body>
+</html>"""
+
+
 class GenerationService:
     """Сервис для генерации сайтов по описанию через OpenRouter API"""
     
@@ -135,23 +181,22 @@ class GenerationService:
         else:
             # Несколько страниц - пытаемся найти JSON или отдельные HTML блоки
             # Сначала пробуем найти JSON
-            json_match = re.search(r'\{[^{}]*"page_\d+"[^{}]*\}', content, re.DOTALL)
+            json_match = _JSON_PAGES_RE.search(content)
             if json_match:
                 try:
-                    import json
-                    pages_dict = json.loads(json_match.group())
+                    pages_dict = orjson.loads(json_match.group())
                     for key, html in pages_dict.items():
                         if key.startswith("page_"):
                             pages.append({
                                 "page_id": key,
                                 "html": html
                             })
-                except:
-                    pass
+                except Exception:
+                    logger.exception("Failed to parse generated pages JSON")
             
             # Если JSON не найден, ищем отдельные HTML блоки
             if not pages:
-                html_blocks = re.findall(r'<html[^>]*>.*?</html>', content, re.DOTALL | re.IGNORECASE)
+                html_blocks = _HTML_RE.findall(content)
                 for i, html in enumerate(html_blocks[:num_pages], 1):
                     pages.append({
                         "page_id": f"page_{i}",
@@ -170,12 +215,12 @@ class GenerationService:
     def _extract_html(self, content: str) -> str:
         """Извлекает HTML код из текста"""
         # Ищем HTML теги
-        html_match = re.search(r'<html[^>]*>.*?</html>', content, re.DOTALL | re.IGNORECASE)
+        html_match = _HTML_RE.search(content)
         if html_match:
             return html_match.group()
         
         # Если нет полного HTML, ищем body
-        body_match = re.search(r'<body[^>]*>.*?</body>', content, re.DOTALL | re.IGNORECASE)
+        body_match = _BODY_RE.search(content)
         if body_match:
             return f"<!DOCTYPE html><html><head><meta charset='UTF-8'><title>Generated Site</title></head>{body_match.group()}</html>"
         
@@ -184,38 +229,5 @@ class GenerationService:
     
     def _create_default_html(self, description: str) -> str:
         """Создает базовую HTML страницу если генерация не удалась"""
-        return f"""<!DOCTYPE html>
-<html lang="ru">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Generated Site</title>
-    <style>
-        * {{
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }}
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, Cantarell, sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            min-height: 100vh;
-            position: relative;
-        }}
-        .block {{
-            position: absolute;
-            background: rgba(255, 255, 255, 0.95);
-            border-radius: 12px;
-            padding: 2vw;
-            box-shadow: 0 8px 32px rgba(0, 0, 0, 0.1);
-        }}
-    </style>
-</head>
-<body>
-    <div class="block" style="left: 10vw; top: 10vh; width: 80vw; height: auto; padding: 3vw;">
-        <h1 style="font-size: 4vw; margin-bottom: 2vh; color: #333;">Сгенерированный сайт</h1>
-        <p style="font-size: 2vw; line-height: 1.6; color: #666;">{description[:200]}</p>
-    </div>
-</body>
-</html>"""
+        return _DEFAULT_HTML_TMPL % description[:200]
 
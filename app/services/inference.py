@@ -2,11 +2,18 @@
 Сервис для выполнения детекции объектов с помощью Detectron2
 """
 
+import asyncio
+import contextlib
+import multiprocessing
+import threading
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 import cv2
+import torch
+from torchvision.ops import box_iou
 
 warnings.filterwarnings("ignore", category=UserWarning)
 warnings.filterwarnings("ignore", category=FutureWarning)
@@ -17,6 +24,16 @@ from detectron2.data.detection_utils import read_image
 from detectron2.engine import DefaultPredictor
 from detectron2.utils.visualizer import Visualizer, ColorMode
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# Начиная с этого количества объектов IoU на CPU считается ядром Numba
+# (на меньших количествах накладные расходы вызова не окупаются)
+NUMBA_IOU_MIN_INSTANCES = 32
+
 
 class InferenceService:
     """Сервис для выполнения инференса на изображениях"""
@@ -28,7 +45,10 @@ class InferenceService:
         num_classes: int = 1,
         thing_classes: List[str] = None,
         confidence_threshold: float = 0.5,
-        device: Optional[str] = None
+        device: Optional[str] = None,
+        workers: int = 0,
+        fp16: bool = True,
+        compile_model: bool = False
     ):
         """
         Инициализация сервиса инференса
@@ -40,12 +60,46 @@ class InferenceService:
             thing_classes: Список имен классов
             confidence_threshold: Порог уверенности
             device: Устройство (cpu/cuda) или None для автоопределения
+            workers: Количество процессов инференса; 0 - модель загружается
+                в текущем процессе, детекция выполняется в пуле потоков
+            fp16: Выполнять прямой проход в FP16 (autocast), если модель на CUDA
+            compile_model: Компилировать модель через torch.compile
+                (первые запросы каждого нового размера изображения будут медленными)
         """
         self.model_path = Path(model_path)
         self.config_path = Path(config_path)
         self.num_classes = num_classes
         self.thing_classes = thing_classes or ["frame"]
         self.confidence_threshold = confidence_threshold
+        self.workers = workers
+        self.fp16 = fp16
+        
+        # Предиктор вызывается из нескольких потоков (run_in_executor),
+        # поэтому прямой проход модели выполняется под блокировкой
+        self._predict_lock = threading.Lock()
+        self._inf_pool: Optional[ProcessPoolExecutor] = None
+        
+        if workers > 0:
+            # Модель загружается один раз в каждом процессе пула,
+            # а не в процессе API
+            self.cfg = None
+            self.predictor = None
+            self._inf_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=({
+                    "model_path": model_path,
+                    "config_path": config_path,
+                    "num_classes": num_classes,
+                    "thing_classes": self.thing_classes,
+                    "confidence_threshold": confidence_threshold,
+                    "device": device,
+                    "fp16": fp16,
+                    "compile_model": compile_model
+                },)
+            )
+            return
         
         # Настройка конфигурации
         self.cfg = self._setup_cfg(device)
@@ -53,6 +107,53 @@ class InferenceService:
         # Создание предиктора
         self.predictor = DefaultPredictor(self.cfg)
         
+        # FP16 имеет смысл только на GPU (тензорные ядра, вдвое меньше трафика памяти)
+        self.fp16 = fp16 and self.cfg.MODEL.DEVICE.startswith("cuda")
+        
+        if compile_model:
+            # На CUDA reduce-overhead дополнительно использует CUDA graphs;
+            # размер скриншотов задается viewport, поэтому форм немного
+            mode = "reduce-overhead" if self.cfg.MODEL.DEVICE.startswith("cuda") else "default"
+            self.predictor.model = torch.compile(self.predictor.model, mode=mode)
+    
+    def close(self):
+        """Останавливает процессы инференса (если используются)"""
+        if self._inf_pool is not None:
+            self._inf_pool.shutdown(wait=True)
+            self._inf_pool = None
+    
+    async def detect_objects_async(self, image: Union[np.ndarray, bytes, str]) -> Dict:
+        """
+        Выполняет детекцию объектов, не блокируя event loop
+        
+        Args:
+            image: Путь к изображению, содержимое файла изображения
+                или уже декодированное изображение (BGR)
+            
+        Returns:
+            Словарь с результатами детекции
+        """
+        results = await self.detect_objects_batch_async([image])
+        return results[0]
+    
+    async def detect_objects_batch_async(self, images: List[Union[np.ndarray, bytes, str]]) -> List[Dict]:
+        """
+        Выполняет батчевую детекцию в процессе пула или в отдельном потоке
+        
+        Args:
+            images: Список путей к изображениям, содержимого файлов изображений
+                или декодированных изображений (BGR)
+            
+        Returns:
+            Список словарей с результатами детекции (в порядке images)
+        """
+        loop = asyncio.get_running_loop()
+        if self._inf_pool is not None:
+            # memoryview нельзя передать в другой процесс
+            images = [bytes(image) if isinstance(image, memoryview) else image for image in images]
+            return await loop.run_in_executor(self._inf_pool, _detect_batch_in_worker, images)
+        return await loop.run_in_executor(None, self.detect_objects_batch, images)
+    
     def _setup_cfg(self, device: Optional[str] = None):
         """Настройка конфигурации Detectron2"""
         cfg = get_cfg()
@@ -67,7 +168,6 @@ class InferenceService:
         if device:
             cfg.MODEL.DEVICE = device
         else:
-            import torch
             if torch.cuda.is_available():
                 cfg.MODEL.DEVICE = "cuda"
             else:
@@ -86,23 +186,170 @@ class InferenceService:
         cfg.freeze()
         return cfg
     
-    def detect_objects(self, image_path: str) -> Dict:
+    def warmup(self, width: int = 390, height: int = 2532):
+        """
+        Выполняет пробный прямой проход модели (и компилирует ядро IoU),
+        чтобы первый запрос не тратил время на инициализацию
+        
+        Args:
+            width: Ширина пробного изображения
+            height: Высота пробного изображения
+        """
+        if self._inf_pool is not None:
+            # Модель прогревается инициализатором каждого процесса;
+            # пробные задачи заставляют пул запустить процессы сразу
+            list(self._inf_pool.map(_warmup_worker, range(self.workers)))
+            return
+        
+        if self.cfg.MODEL.DEVICE.startswith("cuda"):
+            # Скриншоты имеют стабильный размер, поэтому кэшируем лучший алгоритм свертки
+            torch.backends.cudnn.benchmark = True
+        
+        dummy = np.zeros((height, width, 3), np.uint8)
+        with self._predict_lock, self._autocast():
+            self.predictor(dummy)
+        
+        if _iou_pairs is not None and not self.cfg.MODEL.DEVICE.startswith("cuda"):
+            # Компиляция ядра Numba (или загрузка из кэша) при старте, а не на первом запросе
+            _iou_pairs(np.zeros((2, 4), np.float32), 0.1)
+    
+    @staticmethod
+    def decode_image(data: Union[bytes, memoryview]) -> np.ndarray:
+        """
+        Декодирует изображение из байтов (PNG, JPEG и т.д.) в массив BGR
+        
+        Args:
+            data: Содержимое файла изображения
+            
+        Returns:
+            Изображение в формате BGR
+        """
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Cannot decode image")
+        return image
+    
+    def detect_objects(self, image: Union[np.ndarray, bytes, str]) -> Dict:
         """
         Выполняет детекцию объектов на изображении
         
         Args:
-            image_path: Путь к изображению
+            image: Путь к изображению, содержимое файла изображения
+                или уже декодированное изображение (BGR)
+            
+        Returns:
+            Словарь с результатами детекции
+        """
+        if self._inf_pool is not None:
+            return self._inf_pool.submit(_detect_batch_in_worker, [image]).result()[0]
+        
+        return self._detect_on_array(self._load_image(image))
+    
+    def detect_objects_array(self, image: np.ndarray) -> Dict:
+        """
+        Выполняет детекцию объектов на уже декодированном изображении
+        
+        Args:
+            image: Изображение в формате BGR (например, из cv2.imdecode)
             
         Returns:
             Словарь с результатами детекции
         """
-        # Загрузка изображения
-        image = read_image(image_path, format="BGR")
+        if self._inf_pool is not None:
+            return self._inf_pool.submit(_detect_batch_in_worker, [image]).result()[0]
         
-        # Выполнение предсказания
-        predictions = self.predictor(image)
-        instances = predictions["instances"].to("cpu")
+        return self._detect_on_array(image)
+    
+    def _detect_on_array(self, image: np.ndarray) -> Dict:
+        """
+        Выполняет предсказание модели на изображении BGR
         
+        Args:
+            image: Изображение в формате BGR
+            
+        Returns:
+            Словарь с результатами детекции
+        """
+        with self._predict_lock, self._autocast():
+            predictions = self.predictor(image)
+        
+        return self._process_instances(predictions["instances"])
+    
+    def detect_objects_batch(self, images: List[Union[np.ndarray, bytes, str]]) -> List[Dict]:
+        """
+        Выполняет детекцию объектов на нескольких изображениях
+        за один прямой проход модели
+        
+        Args:
+            images: Список путей к изображениям, содержимого файлов изображений
+                или декодированных изображений (BGR)
+            
+        Returns:
+            Список словарей с результатами детекции (в порядке images)
+        """
+        if not images:
+            return []
+        
+        if self._inf_pool is not None:
+            return self._inf_pool.submit(_detect_batch_in_worker, images).result()
+        
+        inputs = [self._prepare_input(self._load_image(image)) for image in images]
+        
+        # Модель сама собирает входы в один батч (ImageList)
+        with self._predict_lock, torch.no_grad(), self._autocast():
+            predictions = self.predictor.model(inputs)
+        
+        return [
+            self._process_instances(prediction["instances"])
+            for prediction in predictions
+        ]
+    
+    def _autocast(self):
+        """
+        Контекст прямого прохода модели: autocast в FP16 на CUDA
+        
+        Маски на выходе бинаризуются, а декодирование боксов Detectron2
+        выполняет в FP32, поэтому точность результата не страдает
+        """
+        if self.fp16:
+            return torch.autocast(device_type="cuda", dtype=torch.float16)
+        return contextlib.nullcontext()
+    
+    def _load_image(self, image: Union[np.ndarray, bytes, str]) -> np.ndarray:
+        """Загружает изображение с диска или декодирует его из байтов"""
+        if isinstance(image, np.ndarray):
+            return image
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return self.decode_image(image)
+        return read_image(image, format="BGR")
+    
+    def _prepare_input(self, image: np.ndarray) -> Dict:
+        """
+        Подготавливает изображение для модели так же, как DefaultPredictor
+        
+        Args:
+            image: Изображение в формате BGR
+            
+        Returns:
+            Словарь входных данных модели
+        """
+        if self.predictor.input_format == "RGB":
+            image = image[:, :, ::-1]
+        height, width = image.shape[:2]
+        transformed = self.predictor.aug.get_transform(image).apply_image(image)
+        tensor = torch.as_tensor(transformed.astype("float32").transpose(2, 0, 1))
+        return {"image": tensor, "height": height, "width": width}
+    
+    def _process_instances(self, instances) -> Dict:
+        """
+        Формирует результат детекции из предсказанных экземпляров
+        
+        Args:
+            instances: Экземпляры детекции (на устройстве модели)
+            
+        Returns:
+            Словарь с результатами детекции
+        """
         num_instances = len(instances)
         
         if num_instances == 0:
@@ -113,15 +360,16 @@ class InferenceService:
                 "image_size": list(instances.image_size) if hasattr(instances, 'image_size') else None
             }
         
-        # Извлечение информации об объектах
-        boxes = instances.pred_boxes.tensor.numpy()
-        scores = instances.scores.numpy()
-        masks = instances.pred_masks.numpy()
+        # Извлечение информации об объектах (на CPU переносятся только нужные данные)
+        boxes = instances.pred_boxes.tensor.cpu().numpy()
+        scores = instances.scores.cpu().numpy()
+        # Площади масок считаются одной редукцией на устройстве: переносятся N чисел, а не N масок HxW
+        mask_areas = instances.pred_masks.flatten(1).sum(dim=1).to(torch.int64).cpu().tolist()
         
         objects = []
         for i in range(num_instances):
             bbox = boxes[i]
-            mask_area = int(masks[i].sum())
+            mask_area = mask_areas[i]
             
             objects.append({
                 "id": i,
@@ -167,61 +415,99 @@ class InferenceService:
                 "overlaps": []
             }
         
-        boxes = instances.pred_boxes.tensor.numpy()
-        overlaps = []
+        boxes = instances.pred_boxes.tensor
+        if _iou_pairs is not None and boxes.device.type == "cpu" and num_instances > NUMBA_IOU_MIN_INSTANCES:
+            # Много объектов на CPU: попарный IoU в скомпилированном параллельном цикле
+            pairs_i, pairs_j, ious = _iou_pairs(boxes.numpy().astype(np.float32), iou_threshold)
+            pairs = np.stack([pairs_i, pairs_j], axis=1)
+            pair_iou = ious.tolist()
+            pair_scores = instances.scores.numpy()[pairs].tolist()
+            pairs = pairs.tolist()
+        else:
+            # IoU всех пар считается на устройстве модели;
+            # на CPU переносятся только индексы пар выше порога и их значения
+            iou = box_iou(boxes, boxes)
+            pairs = torch.triu(iou >= iou_threshold, diagonal=1).nonzero()
+            pair_iou = iou[pairs[:, 0], pairs[:, 1]].cpu().tolist()
+            pair_scores = instances.scores[pairs].cpu().tolist()
+            pairs = pairs.cpu().tolist()
         
-        for i in range(num_instances):
-            for j in range(i + 1, num_instances):
-                iou_value = self._calculate_iou(boxes[i], boxes[j])
-                if iou_value >= iou_threshold:
-                    overlaps.append({
-                        "instance1": int(i),
-                        "instance2": int(j),
-                        "iou": float(iou_value),
-                        "score1": float(instances.scores[i]),
-                        "score2": float(instances.scores[j])
-                    })
+        overlaps = [
+            {
+                "instance1": i,
+                "instance2": j,
+                "iou": iou_value,
+                "score1": score1,
+                "score2": score2
+            }
+            for (i, j), iou_value, (score1, score2) in zip(pairs, pair_iou, pair_scores)
+        ]
         
         return {
             "total_overlaps": len(overlaps),
             "overlaps": overlaps
         }
-    
-    def _calculate_iou(self, box1: np.ndarray, box2: np.ndarray) -> float:
+
+
+if numba is not None:
+    @numba.njit(cache=True, parallel=True)
+    def _iou_pairs(boxes: np.ndarray, threshold: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
         """
-        Вычисляет IoU для двух bounding boxes
+        Вычисляет IoU всех пар bounding boxes и отбирает пары выше порога
         
         Args:
-            box1: Первый bounding box [x1, y1, x2, y2]
-            box2: Второй bounding box [x1, y1, x2, y2]
+            boxes: Массив bounding boxes формы (N, 4) [x1, y1, x2, y2]
+            threshold: Порог IoU
             
         Returns:
-            Значение IoU
+            Tuple (индексы i, индексы j, значения IoU) для пар i < j в порядке (i, j)
         """
-        x1_min, y1_min, x1_max, y1_max = box1
-        x2_min, y2_min, x2_max, y2_max = box2
+        n = boxes.shape[0]
+        total = n * (n - 1) // 2
+        pairs_i = np.empty(total, np.int64)
+        pairs_j = np.empty(total, np.int64)
+        ious = np.empty(total, np.float32)
         
-        # Вычисляем координаты пересечения
-        inter_x_min = max(x1_min, x2_min)
-        inter_y_min = max(y1_min, y2_min)
-        inter_x_max = min(x1_max, x2_max)
-        inter_y_max = min(y1_max, y2_max)
+        for i in numba.prange(n):
+            # Пары строки i занимают непрерывный участок выходных массивов
+            offset = i * (2 * n - i - 1) // 2
+            area_i = (boxes[i, 2] - boxes[i, 0]) * (boxes[i, 3] - boxes[i, 1])
+            for j in range(i + 1, n):
+                inter_w = min(boxes[i, 2], boxes[j, 2]) - max(boxes[i, 0], boxes[j, 0])
+                inter_h = min(boxes[i, 3], boxes[j, 3]) - max(boxes[i, 1], boxes[j, 1])
+                iou = 0.0
+                if inter_w > 0 and inter_h > 0:
+                    inter_area = inter_w * inter_h
+                    area_j = (boxes[j, 2] - boxes[j, 0]) * (boxes[j, 3] - boxes[j, 1])
+                    iou = inter_area / (area_i + area_j - inter_area)
+                
+                k = offset + j - i - 1
+                pairs_i[k] = i
+                pairs_j[k] = j
+                ious[k] = iou
         
-        # Если нет пересечения
-        if inter_x_max <= inter_x_min or inter_y_max <= inter_y_min:
-            return 0.0
-        
-        # Площадь пересечения
-        inter_area = (inter_x_max - inter_x_min) * (inter_y_max - inter_y_min)
-        
-        # Площади каждого бокса
-        box1_area = (x1_max - x1_min) * (y1_max - y1_min)
-        box2_area = (x2_max - x2_min) * (y2_max - y2_min)
-        
-        # Площадь объединения
-        union_area = box1_area + box2_area - inter_area
-        
-        if union_area == 0:
-            return 0.0
-        
-        return inter_area / union_area
+        keep = ious >= threshold
+        return pairs_i[keep], pairs_j[keep], ious[keep]
+else:
+    _iou_pairs = None
+
+
+# Экземпляр сервиса в процессе пула инференса
+_worker_service: Optional[InferenceService] = None
+
+
+def _init_worker(service_kwargs: Dict):
+    """Загружает модель в процессе пула инференса"""
+    global _worker_service
+    _worker_service = InferenceService(**service_kwargs)
+    _worker_service.warmup()
+
+
+def _warmup_worker(_: int) -> bool:
+    """Пробная задача: гарантирует, что процесс пула запущен"""
+    return _worker_service is not None
+
+
+def _detect_batch_in_worker(images: List[Union[np.ndarray, bytes, str]]) -> List[Dict]:
+    """Выполняет батчевую детекцию в процессе пула инференса"""
+    return _worker_service.detect_objects_batch(images)
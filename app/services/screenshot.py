@@ -4,39 +4,145 @@
 
 import asyncio
 import base64
+import struct
 from pathlib import Path
-from typing import Optional, Tuple
-from playwright.async_api import async_playwright, Browser, Page
+from typing import List, Optional, Tuple, Union
+from playwright.async_api import async_playwright, Browser, BrowserContext, Page
+
+
+def _png_size(data: bytes) -> Tuple[int, int]:
+    """
+    Возвращает размеры PNG изображения из его заголовка (чанк IHDR)
+    
+    Args:
+        data: PNG байты
+        
+    Returns:
+        Tuple (ширина, высота)
+    """
+    return struct.unpack(">II", data[16:24])
 
 
 class ScreenshotService:
     """Сервис для создания скриншотов HTML страниц"""
     
-    def __init__(self, headless: bool = True):
+    def __init__(self, headless: bool = True, max_pages: int = 4):
         """
         Инициализация сервиса скриншотов
         
         Args:
             headless: Запускать браузер в headless режиме
+            max_pages: Максимальное количество одновременно открытых страниц в пуле
         """
         self.headless = headless
+        self.max_pages = max_pages
         self.browser: Optional[Browser] = None
+        self.context: Optional[BrowserContext] = None
         self.playwright = None
+        # Занятые и свободные места пула (не больше max_pages страниц одновременно)
+        self._page_slots: Optional[asyncio.Semaphore] = None
+        # Открытые страницы, ожидающие повторного использования
+        self._idle_pages: Optional[List[Page]] = None
+        # Блокировка запуска браузера (создается в работающем цикле событий)
+        self._init_lock: Optional[asyncio.Lock] = None
     
     async def initialize(self):
-        """Инициализация Playwright браузера"""
-        if self.browser is None:
+        """
+        Инициализация Playwright браузера и общего контекста с пулом страниц
+        
+        Одновременные вызовы (например, задачи create_screenshots_batch
+        до инициализации сервиса) запускают браузер только один раз
+        """
+        if self.browser is not None:
+            return
+        
+        if self._init_lock is None:
+            self._init_lock = asyncio.Lock()
+        async with self._init_lock:
+            # Пока ждали блокировку, браузер мог запустить другой вызов
+            if self.browser is not None:
+                return
+            
             self.playwright = await async_playwright().start()
-            self.browser = await self.playwright.chromium.launch(headless=self.headless)
+            browser = await self.playwright.chromium.launch(headless=self.headless)
+            self.context = await browser.new_context()
+            self._page_slots = asyncio.Semaphore(self.max_pages)
+            self._idle_pages = []
+            # Браузер публикуется последним: после этого пул страниц уже готов
+            self.browser = browser
     
     async def close(self):
-        """Закрытие браузера"""
-        if self.browser:
-            await self.browser.close()
-        if self.playwright:
-            await self.playwright.stop()
+        """
+        Закрытие браузера
+        
+        Повторный вызов ничего не делает; Playwright останавливается,
+        даже если закрытие браузера завершилось ошибкой
+        """
+        browser, playwright = self.browser, self.playwright
         self.browser = None
+        self.context = None
         self.playwright = None
+        self._page_slots = None
+        self._idle_pages = None
+        
+        try:
+            if browser:
+                await browser.close()
+        finally:
+            if playwright:
+                await playwright.stop()
+    
+    async def _acquire_page(self) -> Page:
+        """
+        Берет страницу из пула общего контекста
+        
+        Сначала занимается место в пуле (ждем, если заняты все max_pages),
+        затем берется свободная страница или открывается новая
+        
+        Returns:
+            Страница браузера
+        """
+        if self.browser is None:
+            await self.initialize()
+        
+        slots = self._page_slots
+        await slots.acquire()
+        try:
+            if self._idle_pages:
+                return self._idle_pages.pop()
+            return await self.context.new_page()
+        except BaseException:
+            # В том числе отмена во время new_page - место не должно потеряться
+            slots.release()
+            raise
+    
+    async def _release_page(self, page: Page):
+        """
+        Возвращает страницу в пул, сбрасывая ее состояние
+        
+        Args:
+            page: Страница, полученная через _acquire_page
+        """
+        slots = self._page_slots
+        if slots is None:
+            # Сервис уже закрыт вместе со страницами
+            return
+        
+        try:
+            await page.goto("about:blank")
+        except BaseException as e:
+            # Страница повреждена (или сброс прерван) - закрываем ее вместо возврата в пул
+            try:
+                await page.close()
+            except Exception:
+                pass
+            if not isinstance(e, Exception):
+                raise
+        else:
+            self._idle_pages.append(page)
+        finally:
+            # Место освобождается в любом случае и будит ожидающих в _acquire_page
+            slots.release()
     
     async def create_screenshot_from_html(
         self,
@@ -45,7 +151,7 @@ class ScreenshotService:
         height: int = 844,
         output_path: Optional[str] = None,
         wait_time: int = 1000
-    ) -> Tuple[str, Tuple[int, int]]:
+    ) -> Tuple[Union[str, bytes], Tuple[int, int]]:
         """
         Создает скриншот из HTML контента
         
@@ -57,12 +163,9 @@ class ScreenshotService:
             wait_time: Время ожидания перед скриншотом (мс)
             
         Returns:
-            Tuple (путь к файлу или base64, размеры изображения)
+            Tuple (путь к файлу или PNG байты, размеры изображения)
         """
-        if self.browser is None:
-            await self.initialize()
-        
-        page = await self.browser.new_page()
+        page = await self._acquire_page()
         
         try:
             # Установка размера viewport
@@ -74,31 +177,80 @@ class ScreenshotService:
             # Ожидание для загрузки всех ресурсов
             await page.wait_for_timeout(wait_time)
             
-            # Получение реальных размеров контента
-            content_size = await page.evaluate("""() => {
-                return {
-                    width: Math.max(document.documentElement.scrollWidth, document.body.scrollWidth),
-                    height: Math.max(document.documentElement.scrollHeight, document.body.scrollHeight)
-                };
-            }""")
+            # full_page сам расширяет снимок до размеров документа,
+            # а реальные размеры берутся из заголовка PNG
+            screenshot_bytes = await page.screenshot(path=output_path, full_page=True)
+            actual_width, actual_height = _png_size(screenshot_bytes)
             
-            # Установка размера viewport под контент
-            actual_width = max(width, content_size["width"])
-            actual_height = max(height, content_size["height"])
-            await page.set_viewport_size({"width": actual_width, "height": actual_height})
-            
-            # Создание скриншота
-            if output_path:
-                await page.screenshot(path=output_path, full_page=True)
-                result = output_path
-            else:
-                screenshot_bytes = await page.screenshot(full_page=True)
-                result = base64.b64encode(screenshot_bytes).decode('utf-8')
+            # Путь к файлу или PNG байты без записи на диск
+            result = output_path if output_path else screenshot_bytes
             
             return result, (actual_width, actual_height)
             
         finally:
-            await page.close()
+            await self._release_page(page)
+    
+    async def create_screenshot_b64(
+        self,
+        html_content: str,
+        width: int = 390,
+        height: int = 844,
+        wait_time: int = 1000
+    ) -> Tuple[str, Tuple[int, int]]:
+        """
+        Создает скриншот из HTML контента в виде base64 строки
+        
+        Нужен только для передачи скриншота в JSON; внутри процесса
+        используйте PNG байты из create_screenshot_from_html
+        
+        Args:
+            html_content: HTML код страницы
+            width: Ширина viewport
+            height: Высота viewport
+            wait_time: Время ожидания перед скриншотом (мс)
+            
+        Returns:
+            Tuple (PNG в base64, размеры изображения)
+        """
+        screenshot_bytes, size = await self.create_screenshot_from_html(
+            html_content,
+            width=width,
+            height=height,
+            wait_time=wait_time
+        )
+        return base64.b64encode(screenshot_bytes).decode('ascii'), size
+    
+    async def create_screenshots_batch(
+        self,
+        html_contents: List[str],
+        width: int = 390,
+        height: int = 844,
+        wait_time: int = 1000
+    ) -> List[Tuple[bytes, Tuple[int, int]]]:
+        """
+        Создает скриншоты нескольких страниц параллельно
+        
+        Одновременно отрисовывается не больше max_pages страниц:
+        остальные ждут освобождения страницы в пуле
+        
+        Args:
+            html_contents: Список HTML кодов страниц
+            width: Ширина viewport
+            height: Высота viewport
+            wait_time: Время ожидания перед скриншотом (мс)
+            
+        Returns:
+            Список Tuple (PNG байты, размеры изображения) в порядке html_contents
+        """
+        return await asyncio.gather(*[
+            self.create_screenshot_from_html(
+                html_content,
+                width=width,
+                height=height,
+                wait_time=wait_time
+            )
+            for html_content in html_contents
+        ])
     
     async def create_screenshot_from_file(
         self,
@@ -106,7 +258,7 @@ class ScreenshotService:
         width: int = 390,
         height: int = 844,
         output_path: Optional[str] = None
-    ) -> Tuple[str, Tuple[int, int]]:
+    ) -> Tuple[Union[str, bytes], Tuple[int, int]]:
         """
         Создает скриншот из HTML файла
         
@@ -134,7 +286,7 @@ class ScreenshotService:
         width: int = 390,
         height: int = 844,
         output_path: Optional[str] = None
-    ) -> Tuple[str, Tuple[int, int]]:
+    ) -> Tuple[Union[str, bytes], Tuple[int, int]]:
         """
         Синхронная обертка для создания скриншота (используется как async)
         
@@ -145,7 +297,7 @@ class ScreenshotService:
             output_path: Путь для сохранения скриншота
             
         Returns:
-            Tuple (путь к файлу или base64, размеры изображения)
+            Tuple (путь к файлу или PNG байты, размеры изображения)
         """
         return await self.create_screenshot_from_html(html_content, width, height, output_path)
 
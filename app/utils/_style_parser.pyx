@@ -0,0 +1,60 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+Разбор строки стиля CSS на Cython
+
+Собирается командой: cythonize -i app/utils/_style_parser.pyx
+Без собранного расширения html_parser использует реализацию на Python
+"""
+
+
+cpdef dict scan_style(str style_str):
+    """
+    Разбирает строку стиля в словарь
+    
+    Поведение совпадает с html_parser._scan_style_py: объявление без двоеточия
+    пропускается, пробелы по краям ключа и значения отбрасываются (как str.strip)
+    
+    Args:
+        style_str: Строка стиля CSS
+    
+    Returns:
+        Словарь в порядке объявления (повторный ключ берет последнее значение)
+    """
+    cdef dict style_dict = {}
+    cdef Py_ssize_t length = len(style_str)
+    cdef Py_ssize_t start = 0
+    cdef Py_ssize_t end, colon, key_start, key_end, value_start, value_end
+    cdef Py_UCS4 ch
+    
+    while start < length:
+        # Граница объявления и первое двоеточие в нем - за один проход
+        end = start
+        colon = -1
+        while end < length:
+            ch = style_str[end]
+            if ch == u';':
+                break
+            if ch == u':' and colon == -1:
+                colon = end
+            end += 1
+        
+        if colon != -1:
+            key_start = start
+            key_end = colon
+            while key_start < key_end and style_str[key_start].isspace():
+                key_start += 1
+            while key_end > key_start and style_str[key_end - 1].isspace():
+                key_end -= 1
+            
+            value_start = colon + 1
+            value_end = end
+            while value_start < value_end and style_str[value_start].isspace():
+                value_start += 1
+            while value_end > value_start and style_str[value_end - 1].isspace():
+                value_end -= 1
+            
+            style_dict[style_str[key_start:key_end]] = style_str[value_start:value_end]
+        
+        start = end + 1
+    
+    return style_dict
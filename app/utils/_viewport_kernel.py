@@ -0,0 +1,21 @@
+"""
+Ядро Numba для пересчета координат блоков в viewport единицы
+
+Импортируется из html_parser при первом большом батче координат
+"""
+
+import numba
+
+
+@numba.njit(cache=True, parallel=True)
+def px_to_viewport(xs, ys, widths, heights, scale_w, scale_h, out_left, out_top, out_width, out_height):
+    """
+    Масштабирует координаты блоков в проценты viewport в предвыделенные массивы
+    
+    Форматирование в строки остается в Python: Numba его не поддерживает
+    """
+    for i in numba.prange(xs.shape[0]):
+        out_left[i] = xs[i] * scale_w
+        out_top[i] = ys[i] * scale_h
+        out_width[i] = widths[i] * scale_w
+        out_height[i] = heights[i] * scale_h
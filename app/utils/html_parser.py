@@ -2,74 +2,379 @@
 Утилиты для парсинга и обработки HTML кода
 """
 
+import asyncio
+import copy
 import re
-from typing import List, Dict, Tuple, Optional
-from bs4 import BeautifulSoup
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Iterator, List, Dict, Tuple, Optional
+import numpy as np
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    # Парсер на C (libxml2): в разы быстрее встроенного html.parser
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    etree = None
+
+try:
+    # Разбор строки стиля на Cython (app/utils/_style_parser.pyx), если расширение собрано
+    from app.utils._style_parser import scan_style as _compiled_scan_style
+except ImportError:
+    _compiled_scan_style = None
+
+# Количество различных строк стиля, результаты разбора которых кэшируются
+STYLE_CACHE_SIZE = 4096
+
+# Количество последних HTML документов, разобранные деревья которых кэшируются
+PARSE_CACHE_SIZE = 32
+
+# Количество потоков для разбора HTML вне цикла событий (см. extract_blocks_async)
+PARSE_WORKERS = 4
+
+# Ключи стиля с координатами блока, которые меняют обновления
+_COORD_KEYS = ('top', 'left', 'width', 'height')
+
+# Начало полного HTML документа (иначе HTML разбирается как фрагмент)
+_DOCUMENT_START_RE = re.compile(r'\s*(?:<!--.*?-->\s*)*<(?:!doctype|html|head|body)\b', re.IGNORECASE | re.DOTALL)
+
+# Класс, которым помечаются блоки страницы
+_BLOCK_CLASS_RE = re.compile(r'\bblock\b')
+
+# Дерево строится только для элементов с классом 'block' (и их содержимого)
+BLOCK_STRAINER = SoupStrainer(class_=_BLOCK_CLASS_RE)
+
+# Парсеры lxml по одному на поток: lxml отпускает GIL при разборе,
+# только если парсер не используется из нескольких потоков одновременно
+_lxml_parsers = threading.local()
+
+# Пул потоков для разбора HTML из асинхронного кода
+_PARSE_POOL = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix='html-parse')
+
+# Начиная с этого количества блоков пересчет координат выполняет ядро Numba
+NUMBA_MIN_BLOCKS = 4096
+
+# Форматирование координат в vw/vh (%-форматирование быстрее f-строк с форматом)
+_format_vw = '%.1fvw'.__mod__
+_format_vh = '%.1fvh'.__mod__
+
+
+def _has_block_class(tag) -> bool:
+    """
+    Проверяет, помечен ли элемент классом 'block'
+    
+    BeautifulSoup уже разбивает атрибут class на список, поэтому обычно
+    достаточно проверки вхождения; регулярное выражение применяется только
+    к классам, содержащим 'block' как подстроку (например, 'card-block')
+    
+    Args:
+        tag: Элемент BeautifulSoup
+        
+    Returns:
+        True, если элемент является блоком
+    """
+    return _is_block(tag.get('class') or ())
+
+
+def _is_block(classes) -> bool:
+    """
+    Проверяет, содержит ли список классов элемента класс 'block'
+    
+    Args:
+        classes: Классы элемента (уже разбитые по пробелам)
+        
+    Returns:
+        True, если элемент является блоком
+    """
+    if 'block' in classes:
+        return True
+    return any('block' in css_class and _BLOCK_CLASS_RE.search(css_class) for css_class in classes)
 
 
 def extract_blocks(html: str) -> List[Dict[str, any]]:
     """
     Извлекает блоки из HTML кода
     
+    Для чтения с последующим обновлением блоков используйте BlockDocument,
+    чтобы не разбирать HTML дважды
+    
     Args:
         html: HTML код страницы
         
     Returns:
         Список словарей с информацией о блоках
     """
-    soup = BeautifulSoup(html, 'html.parser')
-    blocks = []
+    return list(iter_blocks(html))
+
+
+def iter_blocks(html: str) -> Iterator[Dict[str, any]]:
+    """
+    Извлекает блоки из HTML кода по одному
+    
+    Информация о блоке формируется только при запросе очередного элемента,
+    поэтому при досрочном выходе из цикла остальные блоки не обрабатываются
+    
+    Args:
+        html: HTML код страницы
+        
+    Yields:
+        Словари с информацией о блоках (как в extract_blocks)
+    """
+    tree = _parse_cached(html)
+    if tree is not None:
+        for idx, block in enumerate(_iter_lxml_blocks(tree)):
+            yield _block_info(idx, block, _lxml_element_html)
+        return
+    
+    soup = BeautifulSoup(html, 'html.parser', parse_only=BLOCK_STRAINER, on_duplicate_attribute='ignore')
     
     # Ищем все элементы с классом 'block'
-    block_elements = soup.find_all(class_=re.compile(r'\bblock\b'))
+    for idx, block in enumerate(soup.find_all(_has_block_class)):
+        yield _block_info(idx, block)
+
+
+def extract_block_arrays(html: str, include_elements: bool = False) -> Dict[str, any]:
+    """
+    Извлекает координаты блоков в виде массивов NumPy (по массиву на поле)
+    
+    Числа разбираются из строк стиля один раз, дальше с блоками можно работать
+    векторно: например, blocks['top_vh'] < 50.0. Значение в других единицах
+    или не число (например, 'auto') становится NaN
+    
+    Args:
+        html: HTML код страницы
+        include_elements: Добавить список HTML кода блоков ('elements')
+        
+    Returns:
+        Словарь с массивами 'ids', 'top_vh', 'left_vw', 'width_vw', 'height_vh',
+        'z_index' (и 'elements', если запрошено) в порядке блоков
+    """
+    blocks = extract_blocks(html)
+    positions = [block['position'] for block in blocks]
+    
+    arrays = {
+        'ids': np.arange(len(blocks)),
+        'top_vh': _style_numbers([position['top'] for position in positions], 'vh'),
+        'left_vw': _style_numbers([position['left'] for position in positions], 'vw'),
+        'width_vw': _style_numbers([position['width'] for position in positions], 'vw'),
+        'height_vh': _style_numbers([position['height'] for position in positions], 'vh'),
+        'z_index': _style_numbers([block['z_index'] for block in blocks]),
+    }
+    if include_elements:
+        arrays['elements'] = [block['element'] for block in blocks]
+    
+    return arrays
+
+
+def _style_numbers(values: List[str], unit: str = '') -> np.ndarray:
+    """
+    Преобразует значения стиля в числа
     
-    for idx, block in enumerate(block_elements):
-        style = block.get('style', '')
-        style_dict = parse_style(style)
+    Args:
+        values: Значения стиля (например, '12.3vh')
+        unit: Ожидаемые единицы измерения
         
-        blocks.append({
-            'id': idx,
-            'element': str(block),
-            'style': style,
-            'position': {
-                'top': style_dict.get('top', '0vh'),
-                'left': style_dict.get('left', '0vw'),
-                'width': style_dict.get('width', '0vw'),
-                'height': style_dict.get('height', '0vh'),
-            },
-            'z_index': style_dict.get('z-index', '0'),
-        })
+    Returns:
+        Массив float64; NaN для значений в других единицах и не чисел
+    """
+    numbers = []
+    for value in values:
+        number = np.nan
+        if value.endswith(unit):
+            try:
+                number = float(value[:len(value) - len(unit)])
+            except ValueError:
+                pass
+        numbers.append(number)
+    return np.array(numbers, dtype=np.float64)
+
+
+def _parse_lxml(html: str):
+    """
+    Разбирает HTML документ напрямую через lxml.html
+    
+    Фрагмент (HTML без <html>, <head>, <body> и DOCTYPE в начале) разбирается
+    внутри <body>, чтобы при сериализации не добавились теги документа
+    
+    Args:
+        html: HTML код страницы
+        
+    Returns:
+        Корневой элемент документа (<body> для фрагмента) или None, если lxml
+        не установлен или не смог разобрать документ (тогда используется BeautifulSoup)
+    """
+    if etree is None:
+        return None
+    
+    try:
+        if _DOCUMENT_START_RE.match(html):
+            return lxml.html.document_fromstring(html, parser=_lxml_parser())
+        document = lxml.html.document_fromstring(f'<html><body>{html}</body></html>', parser=_lxml_parser())
+        return document.find('body')
+    except (etree.LxmlError, ValueError):
+        # Например, пустой документ или строка с объявлением кодировки
+        return None
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_cached(html: str):
+    """
+    Разбирает HTML документ через lxml.html с кэшированием по содержимому
+    
+    Повторные вызовы для того же HTML (например, чтение блоков до и после
+    обновления) не разбирают документ заново. Дерево из кэша общее для всех
+    вызывающих и не изменяется: для изменений используется его копия
     
-    return blocks
+    Args:
+        html: HTML код страницы
+        
+    Returns:
+        Корневой элемент документа (<body> для фрагмента) или None (см. _parse_lxml)
+    """
+    return _parse_lxml(html)
+
+
+def _lxml_parser():
+    """Парсер lxml.html текущего потока (создается при первом обращении)"""
+    parser = getattr(_lxml_parsers, 'parser', None)
+    if parser is None:
+        # Без DOCTYPE по умолчанию: документ без него сериализуется так же, как был передан
+        parser = _lxml_parsers.parser = lxml.html.HTMLParser(default_doctype=False)
+    return parser
+
+
+def _iter_lxml_blocks(tree) -> Iterator:
+    """Элементы с классом 'block' в порядке документа (обход без промежуточного списка)"""
+    for _, element in etree.iterwalk(tree, events=('start',), tag='*'):
+        classes = element.get('class')
+        if classes and 'block' in classes and _is_block(classes.split()):
+            yield element
+
+
+def _lxml_element_html(element) -> str:
+    """HTML код элемента lxml (без текста, следующего за ним)"""
+    return lxml.html.tostring(element, encoding='unicode', with_tail=False)
+
+
+class _LazyBlock(dict):
+    """
+    Словарь с информацией о блоке, в котором HTML код элемента ('element')
+    формируется только при первом обращении к ключу
+    
+    Сериализация элемента занимает время, пропорциональное размеру его поддерева,
+    а большинству вызывающих нужны только стиль и координаты. До первого обращения
+    ключа 'element' нет среди ключей словаря (in, items, json)
+    """
+    
+    __slots__ = ('_element', '_element_html')
+    
+    def __init__(self, fields: Dict[str, any], element, element_html):
+        super().__init__(fields)
+        self._element = element
+        self._element_html = element_html
+    
+    def __missing__(self, key):
+        if key != 'element':
+            raise KeyError(key)
+        value = self['element'] = self._element_html(self._element)
+        return value
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def __reduce__(self):
+        # Копия и pickle - обычный словарь с уже сформированным HTML кодом
+        self['element']
+        return dict, (dict(self),)
+
+
+def _block_info(idx: int, block, element_html=str) -> Dict[str, any]:
+    """
+    Формирует словарь с информацией о блоке
+    
+    Args:
+        idx: Порядковый номер блока
+        block: Элемент блока (lxml или BeautifulSoup)
+        element_html: Функция, возвращающая HTML код элемента
+        
+    Returns:
+        Словарь с информацией о блоке (HTML код элемента вычисляется при обращении)
+    """
+    style = block.get('style', '')
+    # Только чтение - копия разобранного стиля не нужна
+    style_dict = _parse_style_cached(style) if style else {}
+    
+    return _LazyBlock({
+        'id': idx,
+        'style': style,
+        'position': {
+            'top': style_dict.get('top', '0vh'),
+            'left': style_dict.get('left', '0vw'),
+            'width': style_dict.get('width', '0vw'),
+            'height': style_dict.get('height', '0vh'),
+        },
+        'z_index': style_dict.get('z-index', '0'),
+    }, block, element_html)
 
 
 def parse_style(style_str: str) -> Dict[str, str]:
     """
     Парсит строку стиля в словарь
     
+    Одинаковые строки стиля разбираются один раз (см. _parse_style_cached);
+    возвращается новый словарь, который можно изменять
+    
     Args:
         style_str: Строка стиля CSS
         
     Returns:
         Словарь с парами ключ-значение
     """
-    style_dict = {}
     if not style_str:
-        return style_dict
-    
-    # Разбиваем по точкам с запятой
-    styles = style_str.split(';')
-    for style in styles:
-        style = style.strip()
-        if ':' in style:
-            key, value = style.split(':', 1)
-            key = key.strip()
-            value = value.strip()
-            style_dict[key] = value
+        return {}
+    # dict.copy в разы быстрее построения словаря из кортежа пар
+    return _parse_style_cached(style_str).copy()
+
+
+@lru_cache(maxsize=STYLE_CACHE_SIZE)
+def _parse_style_cached(style_str: str) -> Dict[str, str]:
+    """
+    Разбирает строку стиля в словарь, общий для всех вызывающих
+    
+    Результат хранится в кэше и не должен изменяться: для изменений
+    используется копия (см. parse_style)
+    
+    Args:
+        style_str: Строка стиля CSS
+        
+    Returns:
+        Словарь в порядке объявления (повторный ключ берет последнее значение)
+    """
+    return _scan_style(style_str)
+
+
+def _scan_style_py(style_str: str) -> Dict[str, str]:
+    """Реализация _scan_style на Python (если расширение _style_parser не собрано)"""
+    style_dict = {}
+    
+    # partition возвращает кортеж фиксированного размера и быстрее split(':', 1)
+    # и поиска двоеточия через find в цикле на Python
+    for declaration in style_str.split(';'):
+        key, colon, value = declaration.partition(':')
+        if colon:
+            style_dict[key.strip()] = value.strip()
     
     return style_dict
 
 
+_scan_style = _compiled_scan_style or _scan_style_py
+
+
 def update_block_coordinates(
     html: str,
     block_updates: List[Dict[str, any]]
@@ -77,6 +382,9 @@ def update_block_coordinates(
     """
     Обновляет координаты блоков в HTML
     
+    Блоки ищутся тем же разбором lxml, что и в extract_blocks (по копии
+    дерева из кэша), поэтому i-е обновление относится к extract_blocks(html)[i]
+    
     Args:
         html: Исходный HTML код
         block_updates: Список обновлений для блоков
@@ -84,32 +392,130 @@ def update_block_coordinates(
     Returns:
         Обновленный HTML код
     """
-    soup = BeautifulSoup(html, 'html.parser')
-    block_elements = soup.find_all(class_=re.compile(r'\bblock\b'))
+    # Ни одно обновление не меняет координаты - документ остается как есть
+    if not any(key in update for update in block_updates for key in _COORD_KEYS):
+        return html
     
-    for idx, block in enumerate(block_elements):
-        if idx < len(block_updates):
-            update = block_updates[idx]
-            style_dict = parse_style(block.get('style', ''))
+    return BlockDocument(html).apply_updates(block_updates).to_html()
+
+
+async def extract_blocks_async(html: str) -> List[Dict[str, any]]:
+    """
+    Извлекает блоки из HTML кода в пуле потоков, не блокируя цикл событий
+    
+    Разобранные документы кэшируются (см. _parse_cached), поэтому повторный
+    запрос для того же HTML не разбирает его заново
+    
+    Args:
+        html: HTML код страницы
+        
+    Returns:
+        Список словарей с информацией о блоках
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_PARSE_POOL, extract_blocks, html)
+
+
+async def update_block_coordinates_async(
+    html: str,
+    block_updates: List[Dict[str, any]]
+) -> str:
+    """
+    Обновляет координаты блоков в HTML в пуле потоков, не блокируя цикл событий
+    
+    Args:
+        html: Исходный HTML код
+        block_updates: Список обновлений для блоков
+        
+    Returns:
+        Обновленный HTML код
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_PARSE_POOL, update_block_coordinates, html, block_updates)
+
+
+class BlockDocument:
+    """HTML документ, который разбирается один раз для чтения и обновления блоков"""
+    
+    def __init__(self, html: str):
+        """
+        Разбирает HTML документ и находит в нем блоки
+        
+        Args:
+            html: HTML код страницы
+        """
+        tree = _parse_cached(html)
+        if tree is not None:
+            # Документ изменяется - работаем с копией дерева из кэша (вместе с DOCTYPE)
+            self.fragment = tree.tag == 'body'
+            self.tree = copy.deepcopy(tree) if self.fragment else copy.deepcopy(tree.getroottree()).getroot()
+            self.soup = None
+            self.block_elements = list(_iter_lxml_blocks(self.tree))
+            self._element_html = _lxml_element_html
+        else:
+            # lxml не установлен или не справился с документом
+            self.fragment = False
+            self.tree = None
+            # Из повторяющихся атрибутов остается первый, как в lxml и браузерах
+            self.soup = BeautifulSoup(html, 'html.parser', on_duplicate_attribute='ignore')
+            self.block_elements = self.soup.find_all(_has_block_class)
+            self._element_html = str
+    
+    @property
+    def blocks(self) -> List[Dict[str, any]]:
+        """Список словарей с информацией о блоках (с учетом примененных обновлений)"""
+        return [
+            _block_info(idx, block, self._element_html)
+            for idx, block in enumerate(self.block_elements)
+        ]
+    
+    def apply_updates(self, block_updates: List[Dict[str, any]]) -> "BlockDocument":
+        """
+        Обновляет координаты блоков
+        
+        Args:
+            block_updates: Список обновлений для блоков (в порядке блоков)
             
-            # Обновляем координаты
-            if 'top' in update:
-                style_dict['top'] = update['top']
-            if 'left' in update:
-                style_dict['left'] = update['left']
-            if 'width' in update:
-                style_dict['width'] = update['width']
-            if 'height' in update:
-                style_dict['height'] = update['height']
+        Returns:
+            Этот же документ
+        """
+        # Блоки без обновлений (за пределами block_updates) не трогаем
+        for block, update in zip(self.block_elements, block_updates):
+            coordinates = {key: update[key] for key in _COORD_KEYS if key in update}
+            if not coordinates:
+                # Координаты не меняются - стиль блока остается как есть
+                continue
             
-            # Формируем новую строку стиля
-            style_parts = []
-            for key, value in style_dict.items():
-                style_parts.append(f"{key}:{value}")
+            # Обновляем координаты (у блока без стиля новый стиль - только координаты)
+            style = block.get('style')
+            if style:
+                style_dict = parse_style(style)
+                style_dict.update(coordinates)
+            else:
+                style_dict = coordinates
             
-            block['style'] = ';'.join(style_parts)
+            # Формируем новую строку стиля
+            new_style = ';'.join(f"{key}:{value}" for key, value in style_dict.items())
+            if self.tree is not None:
+                block.set('style', new_style)
+            else:
+                block['style'] = new_style
+        
+        return self
     
-    return str(soup)
+    def to_html(self) -> str:
+        """
+        Возвращает HTML код документа
+        
+        Returns:
+            HTML код с примененными обновлениями
+        """
+        if self.tree is None:
+            return str(self.soup)
+        if self.fragment:
+            # Только содержимое <body>, в который был обернут фрагмент
+            return lxml.html.tostring(self.tree, encoding='unicode')[len('<body>'):-len('</body>')]
+        return lxml.html.tostring(self.tree.getroottree(), encoding='unicode')
 
 
 def convert_pixels_to_viewport(
@@ -134,14 +540,97 @@ def convert_pixels_to_viewport(
     Returns:
         Словарь с координатами в vw/vh
     """
-    left_vw = (x / img_width) * 100
-    top_vh = (y / img_height) * 100
-    width_vw = (width / img_width) * 100
-    height_vh = (height / img_height) * 100
+    scale_w = 100.0 / img_width
+    scale_h = 100.0 / img_height
     
     return {
-        'left': f"{left_vw:.1f}vw",
-        'top': f"{top_vh:.1f}vh",
-        'width': f"{width_vw:.1f}vw",
-        'height': f"{height_vh:.1f}vh",
+        'left': _format_vw(x * scale_w),
+        'top': _format_vh(y * scale_h),
+        'width': _format_vw(width * scale_w),
+        'height': _format_vh(height * scale_h),
     }
+
+
+def convert_pixels_to_viewport_batch(
+    xs: np.ndarray,
+    ys: np.ndarray,
+    widths: np.ndarray,
+    heights: np.ndarray,
+    img_width: int,
+    img_height: int
+) -> List[Dict[str, str]]:
+    """
+    Конвертирует координаты нескольких блоков из пикселей в viewport единицы (vw/vh)
+    
+    Вычисления и форматирование выполняются над массивами целиком;
+    результат совпадает с поэлементным вызовом convert_pixels_to_viewport
+    
+    Args:
+        xs: X координаты в пикселях
+        ys: Y координаты в пикселях
+        widths: Ширины в пикселях
+        heights: Высоты в пикселях
+        img_width: Ширина изображения в пикселях
+        img_height: Высота изображения в пикселях
+        
+    Returns:
+        Список словарей с координатами в vw/vh (в порядке входных массивов)
+    """
+    scale_w = 100.0 / img_width
+    scale_h = 100.0 / img_height
+    
+    # Непрерывные массивы float64 - одна специализация ядра Numba на все вызовы
+    xs = np.ascontiguousarray(xs, dtype=np.float64)
+    ys = np.ascontiguousarray(ys, dtype=np.float64)
+    widths = np.ascontiguousarray(widths, dtype=np.float64)
+    heights = np.ascontiguousarray(heights, dtype=np.float64)
+    
+    kernel = _viewport_kernel() if len(xs) >= NUMBA_MIN_BLOCKS else None
+    if kernel is not None:
+        # Один параллельный проход без промежуточных массивов
+        left_vw = np.empty_like(xs)
+        top_vh = np.empty_like(ys)
+        width_vw = np.empty_like(widths)
+        height_vh = np.empty_like(heights)
+        kernel(
+            xs, ys, widths, heights, scale_w, scale_h,
+            left_vw, top_vh, width_vw, height_vh
+        )
+    else:
+        left_vw = xs * scale_w
+        top_vh = ys * scale_h
+        width_vw = widths * scale_w
+        height_vh = heights * scale_h
+    
+    return [
+        {
+            'left': left,
+            'top': top,
+            'width': width,
+            'height': height,
+        }
+        for left, top, width, height in zip(
+            np.char.mod('%.1fvw', left_vw).tolist(),
+            np.char.mod('%.1fvh', top_vh).tolist(),
+            np.char.mod('%.1fvw', width_vw).tolist(),
+            np.char.mod('%.1fvh', height_vh).tolist(),
+        )
+    ]
+
+
+@lru_cache(maxsize=None)
+def _viewport_kernel():
+    """
+    Ядро Numba для convert_pixels_to_viewport_batch
+    
+    Numba импортируется (а ядро компилируется или загружается из кэша)
+    только при первом батче от NUMBA_MIN_BLOCKS блоков, а не при старте приложения
+    
+    Returns:
+        Функция ядра или None, если numba не установлена
+    """
+    try:
+        from app.utils._viewport_kernel import px_to_viewport
+    except ImportError:
+        return None
+    return px_to_viewport
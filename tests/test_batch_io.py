@@ -0,0 +1,191 @@
+"""
+Тесты пакетной записи и удаления файлов в app.utils.batch_io
+"""
+
+import errno
+import os
+
+import pytest
+
+from app.utils import batch_io
+
+
+def _uring_available(tmp_path) -> bool:
+    if batch_io.liburing is None:
+        return False
+    try:
+        batch_io._write_files_uring([(tmp_path / "probe", b"x")])
+    except OSError:
+        # Например, io_uring запрещен seccomp
+        return False
+    return True
+
+
+@pytest.fixture(params=["uring", "posix"])
+def backend(request, tmp_path, monkeypatch):
+    """Прогоняет тест через io_uring (если доступен) и через обычную запись"""
+    if request.param == "uring":
+        if not _uring_available(tmp_path):
+            pytest.skip("io_uring is not available")
+    else:
+        monkeypatch.setattr(batch_io, "liburing", None)
+    return request.param
+
+
+@pytest.fixture
+def uring(tmp_path):
+    if not _uring_available(tmp_path):
+        pytest.skip("io_uring is not available")
+    return batch_io.liburing
+
+
+def test_write_files_creates_and_overwrites(backend, tmp_path):
+    existing = tmp_path / "existing.html"
+    existing.write_bytes(b"old content that is longer")
+    files = [(tmp_path / f"page_{idx}.html", bytes([idx]) * (idx * 1000)) for idx in range(5)]
+    files.append((existing, b"new"))
+    
+    batch_io.write_files(files)
+    
+    for path, data in files:
+        assert path.read_bytes() == data
+
+
+def test_write_files_batches_above_ring_size(backend, tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_io, "URING_MAX_ENTRIES", 3)
+    files = [(tmp_path / f"{idx}.txt", str(idx).encode()) for idx in range(10)]
+    
+    batch_io.write_files(files)
+    
+    assert [path.read_bytes() for path, _ in files] == [data for _, data in files]
+
+
+def test_write_files_uses_uring_when_available(uring, tmp_path, monkeypatch):
+    def no_posix(files):
+        raise AssertionError("write_files fell back to posix writes")
+    
+    monkeypatch.setattr(batch_io, "_write_files_posix", no_posix)
+    files = [(tmp_path / f"{idx}.html", b"<p>%d</p>" % idx) for idx in range(5)]
+    
+    batch_io.write_files(files)
+    
+    assert [path.read_bytes() for path, _ in files] == [data for _, data in files]
+
+
+def test_remove_dir_uses_uring_when_available(uring, tmp_path, monkeypatch):
+    def no_rmtree(path):
+        raise AssertionError("remove_dir fell back to shutil.rmtree")
+    
+    unlinked = []
+    submit_unlinks = batch_io._submit_unlinks
+    monkeypatch.setattr(batch_io.shutil, "rmtree", no_rmtree)
+    monkeypatch.setattr(batch_io, "_submit_unlinks", lambda paths: (unlinked.extend(paths), submit_unlinks(paths)))
+    site = tmp_path / "site"
+    site.mkdir()
+    for idx in range(3):
+        (site / f"{idx}.html").write_bytes(b"x")
+    
+    batch_io.remove_dir(site)
+    
+    assert not site.exists()
+    assert len(unlinked) == 3
+
+
+def test_posix_short_writes_are_completed(tmp_path, monkeypatch):
+    class ShortWriteFile:
+        """Файл, который записывает не больше 3 байт за вызов"""
+        
+        def __init__(self, path, mode, buffering):
+            self.file = open(path, mode, buffering=buffering)
+        
+        def __enter__(self):
+            return self
+        
+        def __exit__(self, *exc):
+            self.file.close()
+        
+        def write(self, data):
+            return self.file.write(data[:3])
+    
+    monkeypatch.setattr(batch_io, "open", ShortWriteFile, raising=False)
+    path = tmp_path / "short.bin"
+    
+    batch_io._write_files_posix([(path, b"0123456789" * 5)])
+    
+    assert path.read_bytes() == b"0123456789" * 5
+
+
+def test_uring_short_writes_are_completed(uring, tmp_path, monkeypatch):
+    prep_write = uring.io_uring_prep_write
+    # Буферы должны жить до завершения операций
+    buffers = []
+    
+    def prep_short_write(sqe, fd, data, offset):
+        buffers.append(bytes(data[:2]))
+        prep_write(sqe, fd, buffers[-1], offset)
+    
+    monkeypatch.setattr(uring, "io_uring_prep_write", prep_short_write)
+    files = [(tmp_path / f"{idx}.bin", bytes(range(idx, idx + 100))) for idx in range(3)]
+    
+    batch_io._write_files_uring(files)
+    
+    assert [path.read_bytes() for path, _ in files] == [data for _, data in files]
+
+
+def test_uring_error_names_failed_file(uring, tmp_path, monkeypatch):
+    wait_results = batch_io._wait_results
+    
+    def failing_results(ring, count):
+        for index, result in wait_results(ring, count):
+            yield index, (-errno.EIO if index == 1 else result)
+    
+    monkeypatch.setattr(batch_io, "_wait_results", failing_results)
+    files = [(tmp_path / f"{idx}.bin", b"data") for idx in range(3)]
+    
+    with pytest.raises(OSError) as error:
+        batch_io._write_files_uring(files)
+    
+    assert error.value.errno == errno.EIO
+    assert error.value.filename == str(files[1][0])
+
+
+def test_open_error_names_failed_file(backend, tmp_path):
+    missing = tmp_path / "missing" / "page.html"
+    
+    with pytest.raises(FileNotFoundError) as error:
+        batch_io.write_files([(tmp_path / "ok.html", b"ok"), (missing, b"x")])
+    
+    assert error.value.filename == str(missing)
+
+
+def test_remove_dir_flat_directory(backend, tmp_path):
+    site = tmp_path / "site"
+    site.mkdir()
+    for idx in range(600):
+        (site / f"{idx}.html").write_bytes(b"x")
+    os.symlink("0.html", site / "index.html")
+    
+    batch_io.remove_dir(site)
+    
+    assert not site.exists()
+
+
+def test_remove_dir_nested_directory_falls_back_to_rmtree(backend, tmp_path, monkeypatch):
+    site = tmp_path / "site"
+    (site / "assets" / "img").mkdir(parents=True)
+    (site / "index.html").write_bytes(b"x")
+    (site / "assets" / "img" / "logo.png").write_bytes(b"png")
+    
+    rmtree_calls = []
+    rmtree = batch_io.shutil.rmtree
+    monkeypatch.setattr(batch_io.shutil, "rmtree", lambda path: (rmtree_calls.append(path), rmtree(path)))
+    
+    batch_io.remove_dir(site)
+    
+    assert not site.exists()
+    assert rmtree_calls == [site]
+
+
+def test_remove_dir_missing_directory_raises(backend, tmp_path):
+    with pytest.raises(FileNotFoundError):
+        batch_io.remove_dir(tmp_path / "missing")
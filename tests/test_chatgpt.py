@@ -0,0 +1,96 @@
+"""
+Тесты очереди запросов коррекции в app.services.chatgpt (с поддельным клиентом)
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.chatgpt import BatchingChatGPTService
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.calls = 0
+        self.gate = None
+    
+    async def create(self, model, messages, temperature, max_tokens):
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        content = "<div style='position:absolute'>%d</div>" % self.calls
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+@pytest.fixture
+def service():
+    service = BatchingChatGPTService(api_key="test", max_batch=3)
+    service.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+    return service
+
+
+def _detections(idx):
+    return {"objects": [], "total_objects": idx}
+
+
+def test_lone_request_is_sent_without_waiting(service):
+    async def scenario():
+        completions = service.client.chat.completions
+        task = asyncio.create_task(service.correct_code("<div></div>", _detections(0), "page"))
+        # Запрос уходит за несколько итераций цикла событий, без таймеров
+        for _ in range(5):
+            await asyncio.sleep(0)
+        assert completions.calls == 1
+        result = await task
+        await service.aclose()
+        return result
+    
+    result = asyncio.run(scenario())
+    
+    assert result["status"] == "success"
+
+
+def test_concurrent_requests_get_their_own_results(service):
+    async def scenario():
+        results = await asyncio.gather(*[
+            service.correct_code("<div></div>", _detections(idx), "page") for idx in range(7)
+        ])
+        await service.aclose()
+        return results
+    
+    results = asyncio.run(scenario())
+    
+    assert sorted(result["corrected_code"] for result in results) == sorted(
+        "<div style='position:absolute'>%d</div>" % idx for idx in range(1, 8)
+    )
+
+
+def test_aclose_cancels_queued_and_inflight_requests(service):
+    async def scenario():
+        service.client.chat.completions.gate = asyncio.Event()
+        # 3 запроса попадают в батч и зависают в клиенте, остальные ждут в очереди
+        tasks = [
+            asyncio.create_task(service.correct_code("<div></div>", _detections(idx), "page"))
+            for idx in range(3)
+        ]
+        for _ in range(5):
+            await asyncio.sleep(0)
+        tasks += [
+            asyncio.create_task(service.correct_code("<div></div>", _detections(idx), "page"))
+            for idx in range(3, 5)
+        ]
+        await asyncio.sleep(0)
+        
+        # Обработка очереди остановлена, чтобы запросы остались в ней
+        service._worker.cancel()
+        await asyncio.gather(service._worker, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert service._queue.qsize() == 2
+        
+        await asyncio.wait_for(service.aclose(), 1)
+        return await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), 1)
+    
+    results = asyncio.run(scenario())
+    
+    assert all(isinstance(result, asyncio.CancelledError) for result in results)
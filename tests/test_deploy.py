@@ -0,0 +1,77 @@
+"""
+Тесты публикации сайтов в app.services.deploy
+"""
+
+import os
+
+import pytest
+
+from app.services import deploy
+from app.services.deploy import DeployService
+
+
+PAGES = [
+    {"page_id": "page_1", "html": "<p>one</p>"},
+    {"page_id": "page_2", "html": "<p>two</p>"},
+]
+
+
+@pytest.fixture
+def service(tmp_path):
+    return DeployService(sites_dir=str(tmp_path / "sites"))
+
+
+def _failing_write(files):
+    """Записывает первый файл и падает, как при сбое посреди деплоя"""
+    path, data = files[0]
+    path.write_bytes(data)
+    raise OSError("disk full")
+
+
+def test_deploy_site_publishes_complete_site(service):
+    site_hash = service.deploy_site(PAGES, {"title": "t"})
+    
+    assert os.listdir(service.sites_dir) == [site_hash]
+    assert service.get_site_page(site_hash, "index") == "<p>one</p>"
+    assert service.get_site_page(site_hash, "page_2") == "<p>two</p>"
+    assert service.deploy_site(PAGES) == site_hash
+
+
+def test_failed_deploy_leaves_nothing_and_can_be_retried(service, monkeypatch):
+    with monkeypatch.context() as patch:
+        patch.setattr(deploy, "write_files", _failing_write)
+        with pytest.raises(OSError):
+            service.deploy_site(PAGES)
+    
+    assert os.listdir(service.sites_dir) == []
+    
+    site_hash = service.deploy_site(PAGES)
+    assert service.get_site_page(site_hash, "page_2") == "<p>two</p>"
+
+
+def test_failed_batch_deploy_leaves_nothing(service, monkeypatch):
+    monkeypatch.setattr(deploy, "write_files", _failing_write)
+    
+    with pytest.raises(OSError):
+        service.deploy_site_batch([{"pages": PAGES}, {"pages": PAGES[:1]}])
+    
+    assert os.listdir(service.sites_dir) == []
+
+
+def test_publish_keeps_site_published_concurrently(service):
+    site_hash = service.deploy_site(PAGES)
+    site_path = service.sites_dir / site_hash
+    staging_path = service._new_staging_dir(site_hash)
+    (staging_path / "page_1.html").write_text("<p>other</p>")
+    
+    service._publish(staging_path, site_path)
+    
+    assert os.listdir(service.sites_dir) == [site_hash]
+    assert service.get_site_page(site_hash, "page_1") == "<p>one</p>"
+
+
+def test_staging_directories_are_hidden(service):
+    staging_path = service._new_staging_dir("abc")
+    
+    assert service.list_sites() == []
+    assert service.get_site_path(staging_path.name) is None
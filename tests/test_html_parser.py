@@ -0,0 +1,189 @@
+"""
+Тесты чтения и обновления блоков в app.utils.html_parser
+"""
+
+import pytest
+
+from app.utils import html_parser
+from app.utils.html_parser import BlockDocument, extract_blocks, update_block_coordinates
+
+
+@pytest.fixture(params=['lxml', 'html.parser'])
+def backend(request, monkeypatch):
+    """Прогоняет тест на lxml и на запасном пути через BeautifulSoup с html.parser"""
+    if request.param == 'html.parser':
+        monkeypatch.setattr(html_parser, 'etree', None)
+        builders = []
+        soup_class = html_parser.BeautifulSoup
+        
+        def spy_soup(markup, features, **kwargs):
+            builders.append(features)
+            return soup_class(markup, features, **kwargs)
+        
+        monkeypatch.setattr(html_parser, 'BeautifulSoup', spy_soup)
+        html_parser._parse_cached.cache_clear()
+        yield request.param
+        html_parser._parse_cached.cache_clear()
+        # Запасной путь разбирает только через html.parser
+        assert set(builders) <= {'html.parser'}
+        return
+    html_parser._parse_cached.cache_clear()
+    yield request.param
+    html_parser._parse_cached.cache_clear()
+
+
+def _styles(html):
+    return [block['style'] for block in extract_blocks(html)]
+
+
+def test_update_index_matches_extract_index(backend):
+    """i-е обновление меняет блок extract_blocks(html)[i], даже если рядом есть текст, похожий на блоки"""
+    html = (
+        '<html><head><title><div class="block">title</div></title></head><body>'
+        '<textarea><div class="block" style="top:1vh"></div></textarea>'
+        '<div class="block" style="top:1vh">a</div>'
+        '<iframe><div class="block"></div></iframe>'
+        '<p class="x block">b</p>'
+        '<span class="card-block">c</span>'
+        '</body></html>'
+    )
+    blocks = extract_blocks(html)
+    updates = [{'top': f'{idx + 10}vh'} for idx in range(len(blocks))]
+    
+    result = update_block_coordinates(html, updates)
+    
+    assert [block['position']['top'] for block in extract_blocks(result)] == [
+        update['top'] for update in updates
+    ]
+
+
+def test_script_and_textarea_contents_are_kept(backend):
+    html = (
+        '<html><body>'
+        '<script>var s = \'<div class="block" style="top:1vh">\';</script>'
+        '<textarea>&lt;div class="block"&gt;</textarea>'
+        '<div class="block" style="top:1vh">a</div>'
+        '</body></html>'
+    )
+    
+    result = update_block_coordinates(html, [{'left': '5vw'}])
+    
+    assert '<script>var s = \'<div class="block" style="top:1vh">\';</script>' in result
+    assert '<textarea>&lt;div class="block"&gt;</textarea>' in result
+    assert _styles(result) == ['top:1vh;left:5vw']
+
+
+def test_crlf_document(backend):
+    html = (
+        '<html>\r\n<body>\r\n'
+        '<div\r\n class="block"\r\n style="top:1vh;\r\n left:2vw">a\r\nb</div>\r\n'
+        '<div class="block">c</div>\r\n'
+        '</body></html>'
+    )
+    
+    result = update_block_coordinates(html, [{'width': '3vw'}, {'top': '4vh'}])
+    
+    assert _styles(result) == ['top:1vh;left:2vw;width:3vw', 'top:4vh']
+    if backend == 'lxml':
+        # libxml2 нормализует переводы строк, html.parser оставляет их как есть
+        assert [block['element'].count('\r') for block in extract_blocks(result)] == [0, 0]
+
+
+def test_nested_blocks_are_updated_in_document_order(backend):
+    html = (
+        '<html><body>'
+        '<div class="block" style="top:1vh"><div class="block" style="top:2vh">in</div></div>'
+        '<div class="block">after</div>'
+        '</body></html>'
+    )
+    
+    result = update_block_coordinates(html, [{'top': '10vh'}, {'top': '20vh'}, {'top': '30vh'}])
+    
+    assert _styles(result) == ['top:10vh', 'top:20vh', 'top:30vh']
+
+
+def test_duplicate_style_attribute_leaves_single_style(backend):
+    html = '<html><body><div class="block" style="top:1vh" style="left:2vw">a</div></body></html>'
+    
+    result = update_block_coordinates(html, [{'width': '3vw'}])
+    
+    assert result.count('style=') == 1
+    assert _styles(result) == ['top:1vh;width:3vw']
+
+
+@pytest.mark.parametrize('html, expected', [
+    (
+        '<div class="block" style="top:1vh;left:2vw">x</div>',
+        '<div class="block" style="top:5vh;left:2vw">x</div>',
+    ),
+    (
+        'text <div class="block">a</div>\n<p class="block" style="left:1vw">b</p> tail',
+        'text <div class="block" style="top:5vh">a</div>\n<p class="block" style="left:1vw;top:5vh">b</p> tail',
+    ),
+])
+def test_fragment_update_keeps_fragment(backend, html, expected):
+    result = update_block_coordinates(html, [{'top': '5vh'}, {'top': '5vh'}])
+    
+    assert result == expected
+    assert BlockDocument(html).apply_updates([{'top': '5vh'}, {'top': '5vh'}]).to_html() == expected
+
+
+def test_plain_text_is_not_wrapped(backend):
+    assert update_block_coordinates('plain text', [{'top': '1vh'}]) == 'plain text'
+    assert BlockDocument('plain text').to_html() == 'plain text'
+
+
+def test_updates_without_coordinates_return_html_unchanged(backend):
+    html = '<div class="block" style="top : 1vh">a</div>'
+    
+    assert update_block_coordinates(html, [{}, {'color': 'red'}]) == html
+
+
+def test_updates_do_not_change_cached_document(backend):
+    html = '<html><body><div class="block" style="top:1vh">a</div></body></html>'
+    
+    update_block_coordinates(html, [{'top': '9vh'}])
+    
+    assert _styles(html) == ['top:1vh']
+
+
+def test_block_document_matches_update_block_coordinates(backend):
+    html = (
+        '<!DOCTYPE html><html><body>'
+        '<div class="block" style="top:1vh">a</div><div class="block">b</div>'
+        '</body></html>'
+    )
+    updates = [{'top': '2vh'}, {'left': '3vw', 'height': '4vh'}]
+    
+    document = BlockDocument(html).apply_updates(updates)
+    
+    assert document.to_html() == update_block_coordinates(html, updates)
+    assert [block['style'] for block in document.blocks] == ['top:2vh', 'left:3vw;height:4vh']
+
+
+@pytest.mark.parametrize('html', [
+    '<div class="block" style="top:1vh;left:2vw">x</div>',
+    'plain text',
+    '\n<div class="block">a</div>\ntail <p class="block">b</p>',
+    '<!-- header --><section><div class="block">a</div></section>',
+])
+def test_fragment_round_trip(backend, html):
+    """Фрагмент сериализуется без добавленных <html> и <body>"""
+    assert BlockDocument(html).to_html() == html
+
+
+def test_viewport_batch_kernel_matches_numpy_path(monkeypatch):
+    np = pytest.importorskip("numpy")
+    rng = np.random.default_rng(0)
+    count = html_parser.NUMBA_MIN_BLOCKS + 10
+    # Срез с шагом - непрерывность не должна влиять на результат
+    xs, ys, widths, heights = (rng.uniform(0, 2000, count * 2)[::2] for _ in range(4))
+    
+    if html_parser._viewport_kernel() is None:
+        pytest.skip("numba is not installed")
+    result = html_parser.convert_pixels_to_viewport_batch(xs, ys, widths, heights, 390, 844)
+    monkeypatch.setattr(html_parser, '_viewport_kernel', lambda: None)
+    expected = html_parser.convert_pixels_to_viewport_batch(xs, ys, widths, heights, 390, 844)
+    
+    assert result == expected
+    assert result[0] == html_parser.convert_pixels_to_viewport(xs[0], ys[0], widths[0], heights[0], 390, 844)
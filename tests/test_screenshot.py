@@ -0,0 +1,179 @@
+"""
+Тесты пула страниц в app.services.screenshot (с поддельным браузером)
+"""
+
+import asyncio
+import struct
+
+import pytest
+
+from app.services import screenshot
+from app.services.screenshot import ScreenshotService
+
+
+class FakePage:
+    def __init__(self, context):
+        self.context = context
+        self.broken = False
+        self.closed = False
+    
+    async def goto(self, url):
+        if self.broken:
+            raise RuntimeError("page crashed")
+    
+    async def close(self):
+        self.closed = True
+    
+    async def set_viewport_size(self, size):
+        self.size = size
+    
+    async def set_content(self, html, wait_until=None):
+        self.context.active += 1
+        self.context.max_active = max(self.context.max_active, self.context.active)
+    
+    async def wait_for_timeout(self, timeout):
+        await asyncio.sleep(0)
+    
+    async def screenshot(self, path=None, full_page=False):
+        self.context.active -= 1
+        header = b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR"
+        return header + struct.pack(">II", self.size["width"], self.size["height"])
+
+
+class FakeContext:
+    def __init__(self):
+        self.pages = []
+        self.new_page_gate = None
+        self.active = 0
+        self.max_active = 0
+    
+    async def new_page(self):
+        if self.new_page_gate is not None:
+            await self.new_page_gate.wait()
+        page = FakePage(self)
+        self.pages.append(page)
+        return page
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.context = FakeContext()
+    
+    async def new_context(self):
+        return self.context
+    
+    async def close(self):
+        pass
+
+
+class FakePlaywright:
+    launches = 0
+    
+    def __init__(self):
+        self.chromium = self
+    
+    async def start(self):
+        await asyncio.sleep(0)
+        return self
+    
+    async def launch(self, headless=True):
+        FakePlaywright.launches += 1
+        await asyncio.sleep(0)
+        return FakeBrowser()
+    
+    async def stop(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def fake_playwright(monkeypatch):
+    monkeypatch.setattr(screenshot, "async_playwright", FakePlaywright)
+    monkeypatch.setattr(FakePlaywright, "launches", 0)
+
+
+def _run(coro):
+    return asyncio.run(asyncio.wait_for(coro, timeout=5))
+
+
+def test_pages_are_reused():
+    async def scenario():
+        service = ScreenshotService(max_pages=1)
+        first = await service._acquire_page()
+        await service._release_page(first)
+        second = await service._acquire_page()
+        await service.close()
+        return first, second
+    
+    first, second = _run(scenario())
+    
+    assert first is second
+
+
+def test_broken_page_wakes_waiter():
+    async def scenario():
+        service = ScreenshotService(max_pages=1)
+        page = await service._acquire_page()
+        waiter = asyncio.ensure_future(service._acquire_page())
+        await asyncio.sleep(0)
+        
+        page.broken = True
+        await service._release_page(page)
+        new_page = await waiter
+        await service.close()
+        return page, new_page
+    
+    page, new_page = _run(scenario())
+    
+    assert page.closed
+    assert new_page is not page
+
+
+def test_cancelled_new_page_frees_slot():
+    async def scenario():
+        service = ScreenshotService(max_pages=1)
+        await service.initialize()
+        context = service.context
+        context.new_page_gate = asyncio.Event()
+        
+        pending = asyncio.ensure_future(service._acquire_page())
+        await asyncio.sleep(0)
+        pending.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await pending
+        
+        context.new_page_gate.set()
+        page = await service._acquire_page()
+        await service.close()
+        return page
+    
+    assert _run(scenario()) is not None
+
+
+def test_batch_respects_max_pages():
+    async def scenario():
+        service = ScreenshotService(max_pages=2)
+        results = await service.create_screenshots_batch(["<p>a</p>"] * 5, width=100, height=200)
+        context = service.context
+        await service.close()
+        return results, context
+    
+    results, context = _run(scenario())
+    
+    assert [size for _, size in results] == [(100, 200)] * 5
+    assert context.max_active == 2
+    assert len(context.pages) == 2
+
+
+def test_concurrent_lazy_initialization_launches_one_browser():
+    async def scenario():
+        service = ScreenshotService(max_pages=2)
+        results = await service.create_screenshots_batch(["<p>a</p>"] * 5, width=100, height=200)
+        context = service.context
+        await service.close()
+        return results, context
+    
+    results, context = _run(scenario())
+    
+    assert FakePlaywright.launches == 1
+    assert len(results) == 5
+    assert context.max_active == 2
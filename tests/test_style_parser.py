@@ -0,0 +1,55 @@
+"""
+Тесты разбора строк стиля (Python и расширение Cython)
+"""
+
+import random
+
+import pytest
+
+from app.utils import html_parser
+from app.utils.html_parser import parse_style
+
+
+CASES = [
+    "",
+    "top:1vh",
+    "position:absolute; left: 10vw ;width:3vw; height: 4vh;z-index:2",
+    "color:red;;top:5vh;",
+    "background:url(a:b);left:3vw",
+    " : x;left :1vw",
+    "top",
+    "top:1vh;top:2vh",
+    " left : 5vw\t",
+]
+
+
+@pytest.mark.parametrize("style", CASES)
+def test_parse_style_returns_independent_copy(style):
+    parsed = parse_style(style)
+    parsed["#"] = "changed"
+    
+    assert "#" not in parse_style(style)
+    assert parse_style(style) == html_parser._scan_style_py(style)
+
+
+def test_parse_style_values():
+    assert parse_style(" : x;left :1vw;background:url(a:b);top:1vh;top:2vh") == {
+        "": "x",
+        "left": "1vw",
+        "background": "url(a:b)",
+        "top": "2vh",
+    }
+
+
+def test_compiled_scanner_matches_python():
+    compiled = pytest.importorskip("app.utils._style_parser")
+    assert html_parser._scan_style is compiled.scan_style
+    
+    rng = random.Random(0)
+    alphabet = " \t\n\xa0\u2003;:abcxyz-0123%()."
+    styles = CASES + [
+        "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        for _ in range(20000)
+    ]
+    for style in styles:
+        assert compiled.scan_style(style) == html_parser._scan_style_py(style), repr(style)